@@ -0,0 +1,54 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'src'))
+
+from live_chat_parser import loads, parse_live_chat  # noqa: E402
+from synthetic import write_live_chat_json  # noqa: E402
+
+
+def parse_line_by_line(path):
+    # 改善前のjson_to_dfと同じ読み方(DataFrameの構築は除く)
+    chats = []
+    seconds = []
+    with open(path, 'r', encoding='utf-8') as file:
+        for line in file:
+            if line.strip() == '':
+                continue
+            l_json = json.loads(line)
+            j_action = l_json['replayChatItemAction']['actions'][0]
+            if 'addChatItemAction' in j_action:
+                item = j_action['addChatItemAction']['item']
+                if 'liveChatTextMessageRenderer' in item:
+                    message_runs = item['liveChatTextMessageRenderer']['message']['runs']
+                    if message_runs and 'text' in message_runs[0]:
+                        chats.append(message_runs[0]['text'])
+                        seconds.append(int(l_json['replayChatItemAction']['videoOffsetTimeMsec']) // 1000)
+    return chats, seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description='.live_chat.jsonのパース速度の計測')
+    parser.add_argument('-n', type=int, default=1_000_000, help='生成する行数')
+    args = parser.parse_args()
+
+    print(f'decoder: {loads.__module__}')
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'synthetic.live_chat.json')
+        write_live_chat_json(path, args.n)
+        print(f'file size: {os.path.getsize(path) / 1024 ** 2:.1f} MiB')
+
+        for name, parse in (('line-by-line', parse_line_by_line), ('streaming', parse_live_chat)):
+            start = time.perf_counter()
+            chats, _ = parse(path)
+            elapsed = time.perf_counter() - start
+            print(f'{name:>13}: {elapsed:6.2f}s  {args.n / elapsed:10.0f} lines/s  ({len(chats)} chats)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+from array import array
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'src'))
+
+from live_chat_parser import follow_chunks, iter_line_batches, parse_live_chat, parse_live_chat_lines  # noqa: E402
+from synthetic import write_live_chat_fragments  # noqa: E402
+
+
+def wait_then_parse(path, args):
+    # 改善前と同じく、ファイルを全て書き終えてから解析する
+    write_live_chat_fragments(path, args.n, args.fragment_lines, args.fragment_interval)
+    chats, seconds = parse_live_chat(path)
+    os.remove(path)
+    return chats, seconds
+
+
+def parse_while_writing(path, args):
+    # yt-dlpの代わりに別スレッドでフラグメントを書き込み、増えた分を読み進めて解析する
+    writer = threading.Thread(target=write_live_chat_fragments,
+                              args=(path, args.n, args.fragment_lines, args.fragment_interval))
+    writer.start()
+    chats = []
+    seconds = array('q')
+    chunks = follow_chunks(path, lambda: not writer.is_alive(), lambda: None, poll_interval=0.05)
+    for lines in iter_line_batches(chunks):
+        parse_live_chat_lines(lines, chats, seconds)
+    writer.join()
+    os.remove(path)
+    return chats, seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description='書き込み中の.live_chat.jsonを読み進めて解析する場合の計測')
+    parser.add_argument('-n', type=int, default=500_000, help='生成する行数')
+    parser.add_argument('--fragment-lines', type=int, default=2000, help='1フラグメントあたりの行数')
+    parser.add_argument('--fragment-interval', type=float, default=0.01, help='フラグメントの取得間隔(秒)')
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for name, run in (('wait-then-parse', wait_then_parse), ('parse-while-writing', parse_while_writing)):
+            path = os.path.join(directory, f'{name}.live_chat.json')
+            start = time.perf_counter()
+            results[name] = run(path, args)
+            elapsed = time.perf_counter() - start
+            print(f'{name:>20}: {elapsed:6.2f}s  ({len(results[name][0])} chats)')
+    chats, seconds = results['wait-then-parse']
+    streamed_chats, streamed_seconds = results['parse-while-writing']
+    print(f'同じ結果: {chats == streamed_chats and list(seconds) == list(streamed_seconds)}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+import argparse
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'src'))
+
+from synthetic import synthetic_chats  # noqa: E402
+
+
+def write_archive(path, n, length, seed=0):
+    # 配信の盛り上がりを模して、チャットの多い時間帯を作る
+    rng = np.random.default_rng(seed)
+    weights = 1 + 4 * (np.sin(np.arange(length) / 60) > 0.8)
+    seconds = np.sort(rng.choice(length, size=n, p=weights / weights.sum()))
+    df = pd.DataFrame({'chat': synthetic_chats(n, seed), 'second': seconds})
+    from archive import save_dataset
+
+    save_dataset(str(path), {'title': 'live replay benchmark'}, df)
+    return df
+
+
+def main():
+    parser = argparse.ArgumentParser(description='保存済みのチャットをリプレイし、ライブ表示の分析の遅延を計測する')
+    parser.add_argument('-n', type=int, default=20000, help='チャット数')
+    parser.add_argument('--length', type=int, default=1800, help='配信の長さ(秒)')
+    parser.add_argument('--speed', type=float, default=30.0, help='再生速度(倍)')
+    parser.add_argument('--latency', type=float, default=2.0, help='分析までに待つ最大の秒数')
+    parser.add_argument('--batch-size', type=int, default=16)
+    parser.add_argument('--token-size', type=int, default=64)
+    parser.add_argument('--cpu', action='store_true', help='強制的にCPUで実行する')
+    args = parser.parse_args()
+
+    from live_stream import LiveChatAnalyzer
+    from pipeline import load_nlp_components, select_device
+
+    nlp_components = load_nlp_components()
+    with tempfile.TemporaryDirectory() as tmp:
+        source = Path(tmp) / 'replay.parquet'
+        df = write_archive(source, args.n, args.length)
+        updates = []
+        # キャッシュを使うと繰り返し計測した時に推論しなくなるため無効にする
+        analyzer = LiveChatAnalyzer(
+            str(Path(tmp) / 'live.parquet'), str(source), select_device(args.cpu), args.batch_size, args.token_size,
+            nlp_components, speed=args.speed, latency=args.latency, use_cache=False, on_bins=updates.append
+        )
+        start = time.perf_counter()
+        result, _ = analyzer.run()
+        elapsed = time.perf_counter() - start
+
+    report = analyzer.metrics.report()
+    charted = sum(int(update['counts'].sum()) for update in updates)
+    print(f"再生時間: {elapsed:.1f}秒 (配信 {args.length}秒 / {args.speed}倍速)")
+    print(f"分析件数: {len(result)} / {len(df)}  グラフに追加した件数: {charted}  更新回数: {len(updates)}")
+    print(f"マイクロバッチ: {report['stages']['classify'].get('micro_batches', 0)}回")
+    print(f"分析までの遅延: 中央値 {report['latency_p50_seconds']:.2f}秒 / 95% {report['latency_p95_seconds']:.2f}秒 "
+          f"(目標 {args.latency}秒)")
+
+
+if __name__ == '__main__':
+    main()
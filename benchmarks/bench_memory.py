@@ -0,0 +1,87 @@
+import argparse
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'src'))
+
+from constants import EMOTION_NAMES, SCORE_COLUMN_PREFIX  # noqa: E402
+from synthetic import synthetic_chats  # noqa: E402
+
+
+def legacy_frame(chats, seconds, codes, scores, names):
+    # 改善前の表現: 本文と感情はPythonの文字列オブジェクト、秒と分はint64
+    df = pd.DataFrame({'chat': pd.Series(chats, dtype=object), 'second': seconds.astype(np.int64)})
+    df['minute'] = df['second'] // 60
+    df['emotion'] = pd.Series(np.asarray(names, dtype=object)[codes], dtype=object)
+    for i, name in enumerate(names):
+        df[f'{SCORE_COLUMN_PREFIX}{name}'] = scores[:, i]
+    return df
+
+
+def compact_frame(chats, seconds, codes, scores, names):
+    from live_chat_parser import ChatColumns
+    from pipeline import add_emotion_columns
+
+    # ダウンロード時と同じく、ページ毎にまとめて列に追加する
+    columns = ChatColumns()
+    for start in range(0, len(chats), 10_000):
+        columns.extend(chats[start:start + 10_000], seconds[start:start + 10_000])
+    df = columns.to_df()
+    add_emotion_columns(df, codes, scores, names)
+    return df
+
+
+def memory_by_column(df):
+    return df.memory_usage(deep=True, index=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='チャットのDataFrameのメモリ使用量を、改善前の表現と比較する')
+    parser.add_argument('-n', type=int, default=2_000_000, help='チャット数')
+    parser.add_argument('--length', type=int, default=6 * 3600, help='配信の長さ(秒)')
+    args = parser.parse_args()
+
+    names = list(EMOTION_NAMES)
+    rng = np.random.default_rng(0)
+    chats = synthetic_chats(args.n)
+    seconds = np.sort(rng.integers(0, args.length, size=args.n))
+    codes = rng.integers(0, len(names), size=args.n).astype(np.uint8)
+    scores = rng.random((args.n, len(names))).astype(np.float16)
+
+    frames = {}
+    for label, build in (('legacy', legacy_frame), ('compact', compact_frame)):
+        start = time.perf_counter()
+        frames[label] = build(chats, seconds, codes, scores, names)
+        print(f'{label:>8} 構築: {time.perf_counter() - start:6.2f}s')
+
+    legacy, compact = (memory_by_column(frames[label]) for label in ('legacy', 'compact'))
+    print(f"\n{'列':<12}{'改善前(MiB)':>14}{'改善後(MiB)':>14}")
+    for column in ('chat', 'second', 'minute', 'emotion'):
+        print(f'{column:<12}{legacy.get(column, 0) / 1024 ** 2:>14.1f}{compact.get(column, 0) / 1024 ** 2:>14.1f}')
+    score_columns = [column for column in legacy.index if column.startswith(SCORE_COLUMN_PREFIX)]
+    print(f"{'score_*':<12}{legacy[score_columns].sum() / 1024 ** 2:>14.1f}"
+          f"{compact[score_columns].sum() / 1024 ** 2:>14.1f}")
+    print(f"{'合計':<12}{legacy.sum() / 1024 ** 2:>14.1f}{compact.sum() / 1024 ** 2:>14.1f}"
+          f'  ({1 - compact.sum() / legacy.sum():.0%}削減)')
+
+    # 保存したファイルを読み込んだ場合も同じ表現になることを確認する
+    from archive import read_dataset, save_dataset
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = str(Path(tmp) / 'chats.parquet')
+        save_dataset(path, {'title': 'memory benchmark'}, frames['compact'])
+        start = time.perf_counter()
+        loaded, _ = read_dataset(path)
+        elapsed = time.perf_counter() - start
+    print(f'\nparquetの読み込み: {elapsed:.2f}s  {memory_by_column(loaded).sum() / 1024 ** 2:.1f} MiB')
+    print('型: ' + ', '.join(f'{column}={dtype}' for column, dtype in loaded.dtypes.items()
+                            if not column.startswith(SCORE_COLUMN_PREFIX)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,43 @@
+import argparse
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'src'))
+
+import torch  # noqa: E402
+
+from inference_backend import get_backend  # noqa: E402
+from pipeline import load_nlp_components, predict_emotions  # noqa: E402
+from synthetic import synthetic_chats  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description='固定長パディングと動的パディングのスループット比較')
+    parser.add_argument('-n', type=int, default=2000)
+    parser.add_argument('--batch-size', type=int, default=16)
+    parser.add_argument('--token-size', type=int, default=64)
+    parser.add_argument('--device', default='cpu')
+    args = parser.parse_args()
+
+    nlp_components = load_nlp_components()
+    device = torch.device(args.device)
+    tokenizer, model = nlp_components['tokenizer'], get_backend(nlp_components, 'torch', device)
+    texts = synthetic_chats(args.n)
+
+    results = {}
+    for dynamic_padding in (False, True):
+        start = time.perf_counter()
+        labels, _ = predict_emotions(texts, tokenizer, model, args.batch_size, args.token_size, device,
+                                     dynamic_padding=dynamic_padding)
+        elapsed = time.perf_counter() - start
+        results[dynamic_padding] = labels
+        mode = 'dynamic' if dynamic_padding else 'fixed'
+        print(f'{mode:>8}: {elapsed:8.2f}s  {len(texts) / elapsed:8.1f} chats/s')
+
+    agreement = sum(a == b for a, b in zip(results[False], results[True])) / len(texts)
+    print(f'label agreement: {agreement:.4f}')
+
+
+if __name__ == '__main__':
+    main()
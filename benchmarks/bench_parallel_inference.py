@@ -0,0 +1,36 @@
+import argparse
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'src'))
+
+from parallel_inference import predict_emotions_parallel, threads_per_process  # noqa: E402
+from pipeline import load_nlp_components  # noqa: E402
+from synthetic import synthetic_chats  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description='CPUでの複数プロセス推論のスケーリングの計測')
+    parser.add_argument('-n', type=int, default=20000)
+    parser.add_argument('--batch-size', type=int, default=16)
+    parser.add_argument('--token-size', type=int, default=64)
+    parser.add_argument('--processes', type=int, nargs='+', default=[1, 2, 4, 8])
+    args = parser.parse_args()
+
+    # 各プロセスがローカルに保存したモデルを読み込めるよう、先に1度ロードしておく
+    n_labels = load_nlp_components()['model'].config.num_labels
+    texts = synthetic_chats(args.n)
+
+    baseline = None
+    for processes in args.processes:
+        start = time.perf_counter()
+        predict_emotions_parallel(texts, processes, args.batch_size, args.token_size, n_labels)
+        elapsed = time.perf_counter() - start
+        baseline = baseline or elapsed
+        print(f'processes={processes:>2} threads/process={threads_per_process(processes):>2}: '
+              f'{elapsed:7.2f}s  {len(texts) / elapsed:8.1f} chats/s  x{baseline / elapsed:.2f}')
+
+
+if __name__ == '__main__':
+    main()
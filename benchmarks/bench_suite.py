@@ -0,0 +1,204 @@
+import argparse
+import json
+import platform
+import sys
+import tempfile
+import time
+from importlib import metadata
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'src'))
+
+from synthetic import synthetic_chats, write_live_chat_json  # noqa: E402
+from twitch_stub import StubTwitchGQL, synthetic_comments  # noqa: E402
+
+# 結果に記録するパッケージ。更新で遅くなった場合に原因を特定しやすくする
+PACKAGES = ('yt-dlp', 'transformers', 'tokenizers', 'torch', 'pandas', 'numpy', 'pyarrow', 'plotly', 'orjson')
+
+
+def package_versions():
+    versions = {}
+    for package in PACKAGES:
+        try:
+            versions[package] = metadata.version(package)
+        except metadata.PackageNotFoundError:
+            versions[package] = None
+    return versions
+
+
+def measure(run, repeat, items):
+    # 各段階を複数回実行し、最も速かった回を結果とする
+    runs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        runs.append(time.perf_counter() - start)
+    seconds = min(runs)
+    return {'seconds': seconds, 'runs': runs, 'items': items, 'items_per_second': items / seconds if seconds else None}
+
+
+def bench_json_to_df(args, work_dir):
+    from live_chat_parser import json_to_df
+
+    path = work_dir / 'bench.live_chat.json'
+    write_live_chat_json(path, args.n)
+    return measure(lambda: json_to_df(path), args.repeat, args.n)
+
+
+def bench_download_twitch_chats(args, work_dir):
+    from pipeline import ChatAnalyzer, select_device
+
+    comments = synthetic_comments(args.twitch_n, args.twitch_length)
+    with StubTwitchGQL(comments, args.twitch_length, latency=args.latency) as stub:
+        analyzer = ChatAnalyzer(
+            str(work_dir / 'twitch.parquet'), 'https://www.twitch.tv/videos/stub', True, select_device(True),
+            args.batch_size, args.token_size, None, twitch_api_url=stub.url
+        )
+        return measure(lambda: analyzer.download_twitch_chats('stub'), args.repeat, args.twitch_n)
+
+
+def bench_tokenization(args, nlp_components):
+    from tokenization import iter_batches
+
+    texts = synthetic_chats(args.classify_n)
+    tokenizer = nlp_components['tokenizer']
+    return measure(
+        lambda: sum(1 for _ in iter_batches(texts, tokenizer, args.batch_size, args.token_size, True)),
+        args.repeat, len(texts)
+    )
+
+
+def bench_classify_emotions(args, work_dir, nlp_components):
+    from pipeline import ChatAnalyzer, select_device
+
+    texts = synthetic_chats(args.classify_n)
+    # キャッシュを使うと2回目以降の計測が推論を行わなくなるため無効にする
+    analyzer = ChatAnalyzer(
+        str(work_dir / 'classify.parquet'), '', False, select_device(args.cpu), args.batch_size, args.token_size,
+        nlp_components, use_cache=False, backend=args.backend
+    )
+    analyzer.prepare_analysis()
+    return measure(
+        lambda: analyzer.classify_emotions(texts, args.batch_size, args.token_size, analyzer.device),
+        args.repeat, len(texts)
+    )
+
+
+def labeled_df(args, work_dir):
+    import numpy as np
+
+    from constants import EMOTION_NAMES
+    from live_chat_parser import json_to_df
+    from pipeline import add_emotion_columns
+
+    path = work_dir / 'bench.live_chat.json'
+    if not path.exists():
+        write_live_chat_json(path, args.n)
+    df = json_to_df(path)
+    rng = np.random.default_rng(0)
+    scores = rng.dirichlet(np.ones(len(EMOTION_NAMES)), size=len(df)).astype(np.float16)
+    add_emotion_columns(df, scores.argmax(axis=1).astype(np.uint8), scores, list(EMOTION_NAMES))
+    return df
+
+
+def bench_csv_roundtrip(args, work_dir, df):
+    from archive import read_dataset, save_dataset
+
+    path = str(work_dir / 'roundtrip.csv')
+
+    def run():
+        save_dataset(path, {'title': 'benchmark'}, df)
+        read_dataset(path)
+
+    return measure(run, args.repeat, len(df))
+
+
+def bench_plot_figure(args, df):
+    from constants import EMOTION_COLORS
+    from plot_data import build_emotion_figure, emotion_second_counts
+
+    emotion_names = list(reversed(EMOTION_COLORS.keys()))
+
+    def run():
+        # Tab2Widget.update_plotと同じく、集計してからグラフを作成し、WebEngineに渡すJSONにする
+        matrix = emotion_second_counts(df['second'], df['emotion'], emotion_names)
+        build_emotion_figure(matrix, emotion_names, args.bin_width).to_json()
+
+    return measure(run, args.repeat, len(df))
+
+
+def compare_with_baseline(result, baseline, threshold):
+    # 基準より threshold の割合以上遅くなった段階を返す
+    regressions = []
+    print(f"{'stage':<24}{'baseline':>11}{'current':>11}{'ratio':>8}", file=sys.stderr)
+    for stage, current in result['stages'].items():
+        previous = baseline.get('stages', {}).get(stage)
+        if previous is None:
+            continue
+        ratio = current['seconds'] / previous['seconds']
+        print(f"{stage:<24}{previous['seconds']:>10.3f}s{current['seconds']:>10.3f}s{ratio:>8.2f}x",
+              file=sys.stderr)
+        if ratio > 1 + threshold:
+            regressions.append(stage)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='合成データとローカルのスタブサーバを使った処理全体の計測')
+    parser.add_argument('-n', type=int, default=200_000, help='live_chat.jsonのチャット数')
+    parser.add_argument('--twitch-n', type=int, default=20000, help='Twitchのコメント数')
+    parser.add_argument('--twitch-length', type=int, default=4 * 3600, help='Twitchの動画の長さ(秒)')
+    parser.add_argument('--latency', type=float, default=0.01, help='スタブサーバの1リクエストあたりの遅延(秒)')
+    parser.add_argument('--classify-n', type=int, default=5000, help='トークナイズと感情分析に使うチャット数')
+    parser.add_argument('--batch-size', type=int, default=16)
+    parser.add_argument('--token-size', type=int, default=64)
+    parser.add_argument('--backend', default='torch')
+    parser.add_argument('--cpu', action='store_true', help='強制的にCPUで実行する')
+    parser.add_argument('--bin-width', type=int, default=1, help='グラフの集計間隔(分)')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--skip-model', action='store_true', help='モデルを使う段階(トークナイズ、感情分析)を計測しない')
+    parser.add_argument('--out', help='結果のJSONを保存するパス(省略時は標準出力)')
+    parser.add_argument('--baseline', help='比較する過去の結果のJSON')
+    parser.add_argument('--threshold', type=float, default=0.2, help='基準より遅くなったと判定する割合')
+    args = parser.parse_args()
+
+    stages = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        work_dir = Path(tmp)
+        stages['json_to_df'] = bench_json_to_df(args, work_dir)
+        stages['download_twitch_chats'] = bench_download_twitch_chats(args, work_dir)
+        if not args.skip_model:
+            from pipeline import load_nlp_components
+
+            nlp_components = load_nlp_components()
+            stages['tokenization'] = bench_tokenization(args, nlp_components)
+            stages['classify_emotions'] = bench_classify_emotions(args, work_dir, nlp_components)
+        df = labeled_df(args, work_dir)
+        stages['csv_roundtrip'] = bench_csv_roundtrip(args, work_dir, df)
+        stages['plot_figure'] = bench_plot_figure(args, df)
+
+    result = {
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'packages': package_versions(),
+        'params': {key: value for key, value in vars(args).items() if key not in ('out', 'baseline')},
+        'stages': stages,
+    }
+    output = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.out:
+        Path(args.out).write_text(output + '\n', encoding='utf-8')
+    else:
+        print(output)
+
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text(encoding='utf-8'))
+        regressions = compare_with_baseline(result, baseline, args.threshold)
+        if regressions:
+            print(f"基準より遅くなった段階: {', '.join(regressions)}", file=sys.stderr)
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,79 @@
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'src'))
+
+
+def peak_rss_mib():
+    # Linuxではキロバイト、macOSではバイト単位
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 ** 2 if sys.platform == 'darwin' else peak / 1024
+
+
+def prepare_with_dataset(texts, tokenizer, batch_size, token_size):
+    # 改善前の、datasetsのmap()でトークナイズしてDataLoaderでバッチにする方法
+    from datasets import Dataset
+    from torch.utils.data import DataLoader
+
+    dataset = Dataset.from_dict({'text': texts})
+    dataset = dataset.map(
+        lambda x: tokenizer(x['text'], truncation=True, padding='max_length', max_length=token_size),
+        batched=True)
+    dataset.set_format(type='torch', columns=['input_ids', 'attention_mask'])
+    return sum(1 for _ in DataLoader(dataset, batch_size=batch_size))
+
+
+def prepare_streaming(texts, tokenizer, batch_size, token_size, dynamic_padding):
+    from tokenization import iter_batches
+
+    return sum(1 for _ in iter_batches(texts, tokenizer, batch_size, token_size, dynamic_padding))
+
+
+def run_mode(args):
+    from pipeline import load_nlp_components
+    from synthetic import synthetic_chats
+
+    tokenizer = load_nlp_components()['tokenizer']
+    texts = synthetic_chats(args.n)
+    rss_before = peak_rss_mib()
+    start = time.perf_counter()
+    if args.mode == 'dataset':
+        batches = prepare_with_dataset(texts, tokenizer, args.batch_size, args.token_size)
+    else:
+        batches = prepare_streaming(texts, tokenizer, args.batch_size, args.token_size,
+                                    args.mode == 'streaming-dynamic')
+    elapsed = time.perf_counter() - start
+    print(json.dumps({'mode': args.mode, 'seconds': elapsed, 'batches': batches,
+                      'peak_rss_growth_mib': peak_rss_mib() - rss_before}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='感情分析の前処理(トークナイズとバッチ作成)の時間とメモリの計測')
+    parser.add_argument('-n', type=int, default=200_000)
+    parser.add_argument('--batch-size', type=int, default=16)
+    parser.add_argument('--token-size', type=int, default=64)
+    parser.add_argument('--mode', choices=['dataset', 'streaming-fixed', 'streaming-dynamic'])
+    args = parser.parse_args()
+
+    if args.mode:
+        run_mode(args)
+        return
+
+    # ピークのRSSを正しく測るため、方法毎に別のプロセスで実行する
+    for mode in ('dataset', 'streaming-fixed', 'streaming-dynamic'):
+        output = subprocess.run(
+            [sys.executable, __file__, '--mode', mode, '-n', str(args.n),
+             '--batch-size', str(args.batch_size), '--token-size', str(args.token_size)],
+            check=True, capture_output=True, text=True
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        print(f"{mode:>18}: {result['seconds']:7.2f}s  peak RSS +{result['peak_rss_growth_mib']:7.1f} MiB")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,38 @@
+import argparse
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'src'))
+
+from twitch_client import fetch_comment_pages  # noqa: E402
+from twitch_stub import StubTwitchGQL, synthetic_comments  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description='ローカルのスタブサーバを使ったTwitchコメント取得の計測')
+    parser.add_argument('-n', type=int, default=20000, help='コメント数')
+    parser.add_argument('--length', type=int, default=4 * 3600, help='動画の長さ(秒)')
+    parser.add_argument('--latency', type=float, default=0.05, help='1リクエストあたりの遅延(秒)')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 4, 8])
+    args = parser.parse_args()
+
+    comments = synthetic_comments(args.n, args.length)
+    expected = [comment['id'] for comment in comments]
+    for workers in args.workers:
+        with StubTwitchGQL(comments, args.length, latency=args.latency) as stub:
+            start = time.perf_counter()
+            seconds = []
+            chats = []
+            for page_chats, page_seconds in fetch_comment_pages(stub.url, 'stub', lambda: None,
+                                                                max_workers=workers, max_shards=workers * 4):
+                chats.extend(page_chats)
+                seconds.extend(page_seconds)
+            elapsed = time.perf_counter() - start
+            complete = len(chats) == len(expected) and sorted(seconds) == [c['offset'] for c in comments]
+            print(f'workers={workers:>2}: {elapsed:6.2f}s  {stub.request_count:5d} requests  '
+                  f'{len(chats)} comments  complete={complete}')
+
+
+if __name__ == '__main__':
+    main()
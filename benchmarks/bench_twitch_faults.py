@@ -0,0 +1,83 @@
+import argparse
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'src'))
+
+from constants import TWITCH  # noqa: E402
+from twitch_client import fetch_comment_pages  # noqa: E402
+from twitch_stub import StubTwitchGQL, synthetic_comments  # noqa: E402
+
+
+class Interrupted(Exception):
+    pass
+
+
+def fetch_all(stub, workers, spool_dir=None, stop_after_pages=None):
+    pages = 0
+
+    def check_cancelled():
+        if stop_after_pages is not None and pages >= stop_after_pages:
+            raise Interrupted()
+
+    chats = []
+    seconds = []
+    for page_chats, page_seconds in fetch_comment_pages(stub.url, 'stub', check_cancelled, max_workers=workers,
+                                                        max_shards=workers * 4, spool_dir=spool_dir):
+        pages += 1
+        chats.extend(page_chats)
+        seconds.extend(page_seconds)
+    return chats, seconds
+
+
+def is_complete(comments, seconds):
+    return sorted(seconds) == [comment['offset'] for comment in comments]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='障害を発生させるスタブサーバを使ったTwitchコメント取得の再試行と再開の確認')
+    parser.add_argument('-n', type=int, default=20000, help='コメント数')
+    parser.add_argument('--length', type=int, default=4 * 3600, help='動画の長さ(秒)')
+    parser.add_argument('--latency', type=float, default=0.02, help='1リクエストあたりの遅延(秒)')
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--error-rate', type=float, default=0.1, help='503を返す割合')
+    parser.add_argument('--throttle-rate', type=float, default=0.05, help='429を返す割合')
+    parser.add_argument('--drop-rate', type=float, default=0.05, help='応答せずに接続を切る割合')
+    parser.add_argument('--backoff-base', type=float, default=0.05, help='再試行の待ち時間の基準(秒)')
+    args = parser.parse_args()
+
+    # 計測に時間がかからないよう再試行の待ち時間を短くする
+    TWITCH['BACKOFF_BASE'] = args.backoff_base
+    comments = synthetic_comments(args.n, args.length)
+
+    with StubTwitchGQL(comments, args.length, latency=args.latency) as stub:
+        start = time.perf_counter()
+        fetch_all(stub, args.workers)
+        print(f'障害なし: {time.perf_counter() - start:6.2f}s  {stub.request_count:5d} requests')
+        full_requests = stub.request_count
+
+    with StubTwitchGQL(comments, args.length, latency=args.latency, error_rate=args.error_rate,
+                       throttle_rate=args.throttle_rate, drop_rate=args.drop_rate) as stub:
+        start = time.perf_counter()
+        chats, seconds = fetch_all(stub, args.workers)
+        print(f'障害あり: {time.perf_counter() - start:6.2f}s  {stub.request_count:5d} requests  '
+              f'{stub.fault_counts}  complete={is_complete(comments, seconds)}')
+
+    with tempfile.TemporaryDirectory() as tmp:
+        spool_dir = str(Path(tmp) / 'stub.parquet.twitch-pages')
+        with StubTwitchGQL(comments, args.length, latency=args.latency) as stub:
+            try:
+                fetch_all(stub, args.workers, spool_dir, stop_after_pages=full_requests // 2)
+            except Interrupted:
+                pass
+            interrupted_requests = stub.request_count
+        with StubTwitchGQL(comments, args.length, latency=args.latency) as stub:
+            chats, seconds = fetch_all(stub, args.workers, spool_dir)
+            print(f'中断後の再開: 中断前 {interrupted_requests} requests + 再開後 {stub.request_count} requests '
+                  f'(全体 {full_requests})  complete={is_complete(comments, seconds)}')
+
+
+if __name__ == '__main__':
+    main()
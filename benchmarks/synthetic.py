@@ -0,0 +1,76 @@
+import json
+import os
+import random
+import time
+
+# ライブチャットによく出る短い反応と、やや長めの文章
+SHORT_CHATS = ('草', 'www', 'ｗｗｗｗ', '888', '８８８８８', 'かわいい', 'ナイス！', 'えぇ…', 'きたー！', 'おつ', 'うまい', 'こわ')
+LONG_CHATS = (
+    'いまのプレイめちゃくちゃうまかった',
+    '初見です！いつも切り抜きから見てます',
+    'このゲームのエンディング泣けるんだよなあ',
+    'え、ちょっと待ってそこ行くの？絶対罠だって',
+    '今日の配信も楽しかったです、お疲れさまでした！',
+    'BGMの音量もう少し下げてもらえると助かります',
+)
+CHARS = 'あいうえおかきくけこさしすせそたちつてとなにぬねのはひふへほまみむめもやゆよらりるれろわをん草笑ｗ！？'
+
+
+def synthetic_chats(n, seed=0, short_ratio=0.6, repeat_ratio=0.2):
+    rng = random.Random(seed)
+    chats = []
+    for _ in range(n):
+        r = rng.random()
+        if r < short_ratio:
+            chats.append(rng.choice(SHORT_CHATS))
+        elif r < short_ratio + repeat_ratio:
+            chats.append(rng.choice(LONG_CHATS))
+        else:
+            length = min(int(rng.expovariate(1 / 15)) + 1, 200)
+            chats.append(''.join(rng.choice(CHARS) for _ in range(length)))
+    return chats
+
+
+def live_chat_line(chat, offset_msec, actions=1):
+    # yt-dlpが出力する.live_chat.jsonの1行分
+    item = {
+        'addChatItemAction': {
+            'item': {
+                'liveChatTextMessageRenderer': {
+                    'message': {'runs': [{'text': chat}]},
+                    'authorName': {'simpleText': '視聴者'},
+                    'timestampUsec': str(offset_msec * 1000),
+                }
+            },
+            'clientId': 'synthetic'
+        }
+    }
+    return json.dumps({
+        'replayChatItemAction': {'actions': [item] * actions, 'videoOffsetTimeMsec': str(offset_msec)},
+        'videoOffsetTimeMsec': str(offset_msec),
+        'isLive': True
+    }, ensure_ascii=False)
+
+
+def write_live_chat_json(path, n_lines, duration_sec=36000, seed=0):
+    chats = synthetic_chats(n_lines, seed=seed)
+    with open(path, 'w', encoding='utf-8') as file:
+        for i, chat in enumerate(chats):
+            offset_msec = i * duration_sec * 1000 // max(n_lines, 1)
+            file.write(live_chat_line(chat, offset_msec) + '\n')
+
+
+def write_live_chat_fragments(path, n_lines, fragment_lines=500, fragment_interval=0.01, duration_sec=36000, seed=0):
+    # yt-dlpと同じく、取得したフラグメント毎に.partへ追記し、最後に名前を変える
+    chats = synthetic_chats(n_lines, seed=seed)
+    part_path = f'{path}.part'
+    with open(part_path, 'w', encoding='utf-8') as file:
+        for start in range(0, n_lines, fragment_lines):
+            fragment = ''.join(
+                live_chat_line(chat, i * duration_sec * 1000 // max(n_lines, 1)) + '\n'
+                for i, chat in enumerate(chats[start:start + fragment_lines], start)
+            )
+            file.write(fragment)
+            file.flush()
+            time.sleep(fragment_interval)
+    os.replace(part_path, path)
@@ -0,0 +1,117 @@
+import base64
+import bisect
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from synthetic import synthetic_chats
+
+
+def synthetic_comments(n, length_seconds, seed=0):
+    chats = synthetic_chats(n, seed=seed)
+    return [
+        {'id': f'comment-{i}', 'text': chat, 'offset': i * length_seconds // max(n, 1)}
+        for i, chat in enumerate(chats)
+    ]
+
+
+class StubTwitchGQL:
+    # gql.twitch.tvのVideoCommentsByOffsetOrCursorを模したローカルサーバ。
+    # 指定した割合のリクエストで503、429(Retry-After付き)を返すか、応答せずに接続を切る
+
+    def __init__(self, comments, length_seconds, page_size=50, latency=0.05, error_rate=0.0, throttle_rate=0.0,
+                 drop_rate=0.0, retry_after=0.1, seed=0):
+        self.comments = comments
+        self.offsets = [comment['offset'] for comment in comments]
+        self.length_seconds = length_seconds
+        self.page_size = page_size
+        self.latency = latency
+        self.request_count = 0
+        self.faults = {'error': error_rate, 'throttle': throttle_rate, 'drop': drop_rate}
+        self.fault_counts = {fault: 0 for fault in self.faults}
+        self.retry_after = retry_after
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self.handler_class())
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.server.server_address[1]}/gql'
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def handle_operation(self, operation):
+        if 'query' in operation:
+            return {'data': {'video': {'lengthSeconds': self.length_seconds}}}
+
+        variables = operation['variables']
+        if 'cursor' in variables:
+            start = int(base64.b64decode(variables['cursor']))
+        else:
+            start = bisect.bisect_left(self.offsets, variables['contentOffsetSeconds'])
+        page = self.comments[start:start + self.page_size]
+        edges = [{
+            'cursor': base64.b64encode(str(start + i + 1).encode()).decode(),
+            'node': {
+                'id': comment['id'],
+                'contentOffsetSeconds': comment['offset'],
+                'message': {'fragments': [{'text': comment['text']}]}
+            }
+        } for i, comment in enumerate(page)]
+        return {'data': {'video': {'comments': {
+            'edges': edges,
+            'pageInfo': {'hasNextPage': start + self.page_size < len(self.comments)}
+        }}}}
+
+    def next_fault(self):
+        r = self.rng.random()
+        for fault, rate in self.faults.items():
+            if r < rate:
+                self.fault_counts[fault] += 1
+                return fault
+            r -= rate
+        return None
+
+    def handler_class(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # keep-aliveで接続が使い回されるようにする
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                with stub.lock:
+                    stub.request_count += 1
+                    fault = stub.next_fault()
+                time.sleep(stub.latency)
+                if fault == 'drop':
+                    self.close_connection = True
+                    return
+                if fault is not None:
+                    self.send_response(503 if fault == 'error' else 429)
+                    if fault == 'throttle':
+                        self.send_header('Retry-After', str(stub.retry_after))
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                payload = json.dumps([stub.handle_operation(operation) for operation in body]).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
@@ -0,0 +1,58 @@
+import hashlib
+import os
+
+import numpy as np
+
+
+def texts_fingerprint(texts, model_name):
+    digest = hashlib.sha1(model_name.encode('utf-8'))
+    for text in texts:
+        digest.update(text.encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+class AnalysisCheckpoint:
+    # 感情分析の途中結果を保存先の隣のファイルに定期的に書き出し、中断した場合は続きから再開できるようにする
+    def __init__(self, path, texts, model_name, n_labels, every_batches):
+        self.path = path
+        self.every_batches = every_batches
+        self.fingerprint = texts_fingerprint(texts, model_name)
+        self.batches_since_save = 0
+        self.done = np.zeros(len(texts), dtype=bool)
+        self.codes = np.zeros(len(texts), dtype=np.uint8)
+        self.scores = np.zeros((len(texts), n_labels), dtype=np.float16)
+        self.load()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with np.load(self.path) as saved:
+                # 入力のチャットやモデルが変わっている場合は途中結果を使わない
+                if str(saved['fingerprint']) != self.fingerprint or saved['scores'].shape != self.scores.shape:
+                    return
+                self.done[:] = saved['done']
+                self.codes[:] = saved['codes']
+                self.scores[:] = saved['scores']
+        except (OSError, ValueError, KeyError):
+            return
+
+    def record(self, rows, codes, scores):
+        self.done[rows] = True
+        self.codes[rows] = codes
+        self.scores[rows] = scores
+        self.batches_since_save += 1
+        if self.batches_since_save >= self.every_batches:
+            self.save()
+
+    def save(self):
+        tmp_path = f'{self.path}.tmp.npz'
+        np.savez(tmp_path, fingerprint=np.array(self.fingerprint), done=self.done, codes=self.codes,
+                 scores=self.scores)
+        os.replace(tmp_path, self.path)
+        self.batches_since_save = 0
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
@@ -0,0 +1,115 @@
+import csv
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from constants import EMOTION_NAMES, SCORE_COLUMN_PREFIX
+
+METADATA_KEY = b'chat_archive_metadata'
+PARQUET_EXTENSIONS = ('.parquet', '.pq')
+# チャット本文はPythonの文字列オブジェクトではなく、Arrowの連続したバッファに保持する
+CHAT_DTYPE = pd.StringDtype('pyarrow')
+
+
+def is_parquet(path):
+    return os.path.splitext(path)[1].lower() in PARQUET_EXTENSIONS
+
+
+def chat_array(chats):
+    # ページ毎にArrowの配列にしたチャット(ChunkedArray)は、Pythonの文字列に戻さずにそのまま列にする
+    if isinstance(chats, pa.ChunkedArray):
+        return CHAT_DTYPE.__from_arrow__(chats)
+    return pd.array(chats, dtype=CHAT_DTYPE)
+
+
+def seconds_array(seconds):
+    # 配信開始前のチャットは負の秒数になる場合があるため、0秒に含める
+    return np.clip(np.asarray(seconds, dtype=np.int64), 0, None).astype(np.uint32)
+
+
+def compact_frame(df):
+    # 読み込んだファイルも、ダウンロード直後と同じ省メモリな型に揃える。分は保持せず、必要な時に秒から求める
+    df = df.drop(columns=['minute'], errors='ignore')
+    if 'chat' in df.columns and df['chat'].dtype != CHAT_DTYPE:
+        df['chat'] = df['chat'].astype(CHAT_DTYPE)
+    if 'second' in df.columns and df['second'].dtype != np.uint32:
+        df['second'] = seconds_array(pd.to_numeric(df['second']))
+    if 'emotion' in df.columns and not isinstance(df['emotion'].dtype, pd.CategoricalDtype):
+        df['emotion'] = emotion_categorical(df['emotion'])
+    for column in df.columns:
+        if column.startswith(SCORE_COLUMN_PREFIX) and df[column].dtype != np.float16:
+            df[column] = df[column].astype(np.float16)
+    return df
+
+
+def save_dataframe_with_metadata(path, metadata, df):
+    if 'second' in df.columns and 'minute' not in df.columns:
+        # CSVは表計算ソフトで開くことも多いため、これまで通り分の列も書き出す
+        df = df.copy(deep=False)
+        df.insert(df.columns.get_loc('second') + 1, 'minute', df['second'] // 60)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(f"# attrs: {json.dumps(metadata, ensure_ascii=False)}\n")
+        df.to_csv(f, index=False, quoting=csv.QUOTE_ALL, escapechar='\\', quotechar='"', encoding='utf-8')
+
+
+def column_filter(columns):
+    # 読み込む列は列名のリストか、列名を受け取って読み込むかどうかを返す関数で指定する
+    if columns is None or callable(columns):
+        return columns
+    return lambda column: column in columns
+
+
+def read_csv_with_metadata(file_path, columns=None):
+    metadata = {}
+    with open(file_path, 'r', encoding='utf-8') as file:
+        first_line = file.readline().strip()
+        if first_line.startswith('# attrs:'):
+            metadata = json.loads(first_line[8:])
+        else:
+            file.seek(0)
+        # ファイル全体を文字列として読み込まずに、メタデータ行の続きからそのままパースする
+        df = pd.read_csv(file, quotechar='"', usecols=column_filter(columns))
+
+    return compact_frame(df), metadata
+
+
+def emotion_categorical(values):
+    extra = sorted(set(values.dropna().unique()) - set(EMOTION_NAMES))
+    return pd.Categorical(values, categories=list(EMOTION_NAMES) + extra)
+
+
+def save_parquet_with_metadata(path, metadata, df):
+    if 'emotion' in df.columns and not isinstance(df['emotion'].dtype, pd.CategoricalDtype):
+        df = df.assign(emotion=emotion_categorical(df['emotion']))
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    schema_metadata = dict(table.schema.metadata or {})
+    schema_metadata[METADATA_KEY] = json.dumps(metadata, ensure_ascii=False).encode('utf-8')
+    pq.write_table(table.replace_schema_metadata(schema_metadata), path, compression='zstd')
+
+
+def read_parquet_with_metadata(file_path, columns=None):
+    schema = pq.read_schema(file_path)
+    if columns is not None:
+        # 存在しない列(感情分析前のemotion等)は読み飛ばす
+        columns = list(filter(column_filter(columns), schema.names))
+    table = pq.read_table(file_path, columns=columns)
+    df = compact_frame(table.to_pandas(types_mapper={pa.string(): CHAT_DTYPE, pa.large_string(): CHAT_DTYPE}.get))
+    metadata = json.loads(schema.metadata[METADATA_KEY]) if METADATA_KEY in (schema.metadata or {}) else {}
+    return df, metadata
+
+
+def save_dataset(path, metadata, df):
+    if is_parquet(path):
+        save_parquet_with_metadata(path, metadata, df)
+    else:
+        save_dataframe_with_metadata(path, metadata, df)
+
+
+def read_dataset(path, columns=None):
+    if is_parquet(path):
+        return read_parquet_with_metadata(path, columns)
+    return read_csv_with_metadata(path, columns)
@@ -0,0 +1,103 @@
+import gc
+import math
+import random
+import time
+
+import numpy as np
+import torch
+
+
+def is_out_of_memory(error):
+    if isinstance(error, (torch.cuda.OutOfMemoryError, MemoryError)):
+        return True
+    # CPUでのメモリ不足はRuntimeErrorとして送出される
+    message = str(error).lower()
+    return isinstance(error, RuntimeError) and ('out of memory' in message or "can't allocate memory" in message)
+
+
+def release_memory():
+    gc.collect()
+    if torch.cuda.is_available():
+        torch.cuda.empty_cache()
+
+
+def sample_texts(texts, sample_size, seed=0):
+    if len(texts) <= sample_size:
+        return list(texts)
+    return random.Random(seed).sample(list(texts), sample_size)
+
+
+def token_lengths(texts, tokenizer, max_length):
+    return np.array([
+        len(ids) for ids in tokenizer(texts, truncation=True, max_length=max_length,
+                                      return_token_type_ids=False, return_attention_mask=False)['input_ids']
+    ], dtype=np.int64)
+
+
+def choose_token_size(lengths, percentile, max_length, multiple=8, min_length=16):
+    # 指定した割合のチャットが切り詰められずに収まる長さを、テンソルの形を揃えやすい倍数に切り上げる
+    if len(lengths) == 0:
+        return min_length
+    length = int(math.ceil(np.percentile(lengths, percentile) / multiple) * multiple)
+    return max(min_length, min(length, max_length))
+
+
+def probe_batch_size(texts, predict, candidates, probe_batches, min_gain=0.05):
+    # 小さいバッチサイズから順に処理速度を計測し、速度が伸びなくなるかメモリ不足になったところで止める。
+    # メモリの使用量が最大になるよう、計測には長いチャットを使う
+    if not texts:
+        return candidates[0]
+    try:
+        # 初回の呼び出しにかかる初期化の時間を計測から除く
+        predict(texts[:candidates[0]], candidates[0])
+    except Exception as e:
+        if not is_out_of_memory(e):
+            raise
+        release_memory()
+        return candidates[0]
+    best, best_rate = candidates[0], 0.0
+    for batch_size in candidates:
+        n = batch_size * probe_batches
+        sample = (texts * math.ceil(n / len(texts)))[:n]
+        try:
+            start = time.perf_counter()
+            predict(sample, batch_size)
+            rate = len(sample) / (time.perf_counter() - start)
+        except Exception as e:
+            if not is_out_of_memory(e):
+                raise
+            release_memory()
+            break
+        if rate < best_rate * (1 + min_gain):
+            # これ以上大きくしても速くならないため、メモリに余裕のある小さい方を使う
+            break
+        best, best_rate = batch_size, rate
+    return best
+
+
+def predict_with_backoff(texts, predict, batch_size, n_labels, on_result=None, on_backoff=None):
+    # メモリ不足になった場合はバッチサイズを半分にして、まだ推論していないチャットから続ける
+    codes = np.zeros(len(texts), dtype=np.uint8)
+    scores = np.zeros((len(texts), n_labels), dtype=np.float16)
+    done = np.zeros(len(texts), dtype=bool)
+    remaining = np.arange(len(texts))
+    while True:
+        def record(indices, batch_codes, batch_scores):
+            rows = remaining[np.asarray(indices)]
+            done[rows] = True
+            codes[rows] = batch_codes
+            scores[rows] = batch_scores
+            if on_result is not None:
+                on_result(rows, batch_codes, batch_scores)
+
+        try:
+            predict([texts[i] for i in remaining], batch_size, record)
+            return codes, scores
+        except Exception as e:
+            if not is_out_of_memory(e) or batch_size == 1:
+                raise
+            release_memory()
+            batch_size //= 2
+            remaining = np.flatnonzero(~done)
+            if on_backoff is not None:
+                on_backoff(batch_size)
@@ -0,0 +1,193 @@
+import argparse
+import os
+import signal
+import sys
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from archive import read_dataset
+from constants import AUTO_TUNING, INFERENCE_BACKENDS, JOB_QUEUE, LIVE
+from inference_backend import compare_backends
+from pipeline import (ChatAnalyzer, ProcessError, load_nlp_components, output_path, predict_emotions,
+                      select_device)
+from shared_inference import SharedInferenceExecutor
+
+
+def analyze(args):
+    os.makedirs(args.out, exist_ok=True)
+    shared = args.jobs > 1 and not args.skip_analyze
+    if shared and (args.batch_size is None or args.token_size is None):
+        print('--jobs 2以上で分析する場合は、--batch-sizeと--token-sizeを数値で指定してください', file=sys.stderr)
+        return 2
+
+    # モデルは最初に1度だけロードし、全ての入力で使い回す
+    nlp_components = None if args.skip_analyze else load_nlp_components()
+    device = select_device(args.cpu)
+    # 複数のジョブを同時に実行する場合は、1つの推論スレッドで全てのジョブのチャットをまとめて推論する
+    executor = SharedInferenceExecutor(
+        nlp_components, args.backend, device, args.batch_size, args.token_size, not args.fixed_padding
+    ) if shared else None
+    print_lock = threading.Lock()
+
+    def run_job(source):
+        is_file = os.path.isfile(source)
+        save_path = output_path(source, args.out, f'.{args.format}')
+        # 同時に実行する場合は、どのジョブの出力か分かるよう入力を付ける
+        prefix = '  ' if args.jobs == 1 else f'  [{source}] '
+        last_step = []
+
+        def log(message):
+            with print_lock:
+                print(f'{prefix}{message}', file=sys.stderr)
+
+        def print_step(step_name):
+            if last_step != [step_name]:
+                last_step[:] = [step_name]
+                log(step_name)
+
+        with print_lock:
+            print(f'[{source}] -> {save_path}', file=sys.stderr)
+        analyzer = ChatAnalyzer(
+            save_path, '' if is_file else source, args.skip_analyze, device, args.batch_size, args.token_size,
+            nlp_components, dynamic_padding=not args.fixed_padding, use_cache=not args.no_cache,
+            input_path=source if is_file else None, backend=args.backend, processes=args.processes,
+            incremental=not args.full, length_percentile=args.length_percentile, on_step=print_step,
+            executor=executor
+        )
+        try:
+            analyzer.run()
+            print_step(analyzer.complete_label())
+            return False
+        except ProcessError as e:
+            log(f'エラー: {e}')
+        except Exception as e:
+            log(f'エラーが発生しました: {e}\n{traceback.format_exc()}')
+        return True
+
+    try:
+        with ThreadPoolExecutor(max_workers=args.jobs) as pool:
+            failed = sum(pool.map(run_job, args.inputs))
+    finally:
+        if executor is not None:
+            executor.close()
+    return 1 if failed else 0
+
+
+def live(args):
+    from live_stream import LiveChatAnalyzer
+
+    nlp_components = load_nlp_components()
+    # Ctrl+Cで停止し、それまでに受信したチャットを保存する
+    stop = threading.Event()
+    signal.signal(signal.SIGINT, lambda *_: stop.set())
+
+    def print_bins(update):
+        for i, counts in enumerate(update['counts']):
+            second = update['start'] + i * update['bin_seconds']
+            top = update['names'][counts.argmax()] if counts.sum() else '-'
+            print(f'{second // 60:>4}:{second % 60:02d}  {int(counts.sum()):>5}件  {top}')
+
+    analyzer = LiveChatAnalyzer(
+        args.out, args.source, select_device(args.cpu), args.batch_size, args.token_size, nlp_components,
+        speed=args.speed, latency=args.latency, use_cache=not args.no_cache, backend=args.backend,
+        on_step=lambda step_name: print(step_name, file=sys.stderr), is_cancelled=stop.is_set, on_bins=print_bins
+    )
+    try:
+        analyzer.run()
+    except ProcessError as e:
+        print(f'エラー: {e}', file=sys.stderr)
+        return 1
+    report = analyzer.metrics.report()
+    if 'latency_p95_seconds' in report:
+        print(f"分析までの遅延: 中央値 {report['latency_p50_seconds']:.2f}秒 / 95% {report['latency_p95_seconds']:.2f}秒",
+              file=sys.stderr)
+    return 0
+
+
+def compare(args):
+    df, _ = read_dataset(args.input, columns=['chat'])
+    texts = df['chat'].dropna()
+    texts = texts.sample(min(args.sample, len(texts)), random_state=0).tolist()
+
+    nlp_components = load_nlp_components()
+    tokenizer = nlp_components['tokenizer']
+    report = compare_backends(
+        texts, nlp_components,
+        lambda sample, model, device: predict_emotions(sample, tokenizer, model, args.batch_size, args.token_size,
+                                                       device)[0],
+        select_device(args.cpu), args.backends
+    )
+
+    # 基準との一致率が許容範囲内で最も速い推論エンジンを推奨する
+    candidates = [row for row in report if row['agreement'] >= args.tolerance]
+    recommended = max(candidates, key=lambda row: row['chats_per_second'])['backend']
+    print(f"{'backend':<12}{'seconds':>10}{'chats/s':>12}{'agreement':>12}")
+    for row in report:
+        mark = ' *' if row['backend'] == recommended else ''
+        print(f"{row['backend']:<12}{row['seconds']:>10.2f}{row['chats_per_second']:>12.1f}"
+              f"{row['agreement']:>12.4f}{mark}")
+    print(f'推奨: {recommended} (一致率{args.tolerance}以上で最速)')
+    return 0
+
+
+def size_arg(value):
+    # autoの場合はNoneとし、分析するチャットに合わせて決める
+    return None if value == 'auto' else int(value)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='チャットのダウンロードと感情分析をGUIなしで実行します')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    analyze_parser = subparsers.add_parser('analyze', help='URLまたはファイルのチャットを分析する')
+    analyze_parser.add_argument('inputs', nargs='+', metavar='URL_OR_CSV', help='YoutubeかTwitchのURL、またはparquetかCSVファイル')
+    analyze_parser.add_argument('--out', required=True, help='結果のファイルを保存するディレクトリ')
+    analyze_parser.add_argument('--format', choices=['parquet', 'csv'], default='parquet', help='保存するファイルの形式')
+    analyze_parser.add_argument('--batch-size', type=size_arg, default=16, help='バッチサイズ(autoで自動)')
+    analyze_parser.add_argument('--token-size', type=size_arg, default=64, help='最大トークン数(autoで自動)')
+    analyze_parser.add_argument('--length-percentile', type=float, default=AUTO_TUNING['PERCENTILE'],
+                                help='--token-size autoの場合に、切り詰めずに収めるチャットの割合(%%)')
+    analyze_parser.add_argument('--cpu', action='store_true', help='強制的にCPUで実行する')
+    analyze_parser.add_argument('--skip-analyze', action='store_true', help='チャットのダウンロードのみ行う')
+    analyze_parser.add_argument('--fixed-padding', action='store_true', help='全てのチャットを最大長までパディングする')
+    analyze_parser.add_argument('--no-cache', action='store_true', help='推論結果のキャッシュを使用しない')
+    analyze_parser.add_argument('--backend', choices=INFERENCE_BACKENDS, default='torch', help='推論エンジン')
+    analyze_parser.add_argument('--processes', type=int, default=1, help='CPUで推論する場合のプロセス数')
+    analyze_parser.add_argument('--jobs', type=int, default=1,
+                                help=f"同時に処理する入力の数(GUIの既定値は{JOB_QUEUE['MAX_DOWNLOADS']})。"
+                                     "2以上の場合は全ての入力で1つのモデルを共有してまとめて推論する")
+    analyze_parser.add_argument('--full', action='store_true', help='分析済みの行も含めて全ての行を分析し直す')
+    analyze_parser.set_defaults(func=analyze)
+
+    live_parser = subparsers.add_parser('live', help='配信中のチャットを受信しながら分析する(Ctrl+Cで停止)')
+    live_parser.add_argument('source', help='配信中のYoutube・TwitchのURL、またはリプレイするparquetかCSVファイル')
+    live_parser.add_argument('--out', required=True, help='停止した時に受信したチャットを保存するファイル')
+    live_parser.add_argument('--speed', type=float, default=1.0, help='ファイルをリプレイする場合の再生速度(倍)')
+    live_parser.add_argument('--latency', type=float, default=LIVE['LATENCY_SECONDS'],
+                             help='受信してから分析するまでに待つ最大の秒数')
+    live_parser.add_argument('--batch-size', type=int, default=16)
+    live_parser.add_argument('--token-size', type=int, default=64)
+    live_parser.add_argument('--cpu', action='store_true', help='強制的にCPUで実行する')
+    live_parser.add_argument('--no-cache', action='store_true', help='推論結果のキャッシュを使用しない')
+    live_parser.add_argument('--backend', choices=INFERENCE_BACKENDS, default='torch', help='推論エンジン')
+    live_parser.set_defaults(func=live)
+
+    compare_parser = subparsers.add_parser(
+        'compare-backends', help='推論エンジン毎の速度と、fp32のPyTorchモデルとの結果の一致率を比較する'
+    )
+    compare_parser.add_argument('input', help='サンプルとするチャットを含むparquetかCSVファイル')
+    compare_parser.add_argument('--sample', type=int, default=2000, help='使用するチャットの件数')
+    compare_parser.add_argument('--tolerance', type=float, default=0.98, help='許容する一致率の下限')
+    compare_parser.add_argument('--backends', nargs='+', choices=INFERENCE_BACKENDS, default=list(INFERENCE_BACKENDS))
+    compare_parser.add_argument('--batch-size', type=int, default=16)
+    compare_parser.add_argument('--token-size', type=int, default=64)
+    compare_parser.add_argument('--cpu', action='store_true', help='強制的にCPUで実行する')
+    compare_parser.set_defaults(func=compare)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,4 +1,5 @@
 from enum import Enum, auto
+from pathlib import Path
 
 
 class ErrorCode(Enum):
@@ -12,6 +13,9 @@ ERROR_MESSAGE = {
 
 EMOTION_NAMES = ('喜び', '悲しみ', '期待', '驚き', '怒り', '恐れ', '嫌悪', '信頼', '中立')
 
+# 各感情のスコア(softmaxの確率)を保存する列名の接頭辞
+SCORE_COLUMN_PREFIX = 'score_'
+
 EMOTION_COLORS = {
     '喜び': '#FFD700',  # ゴールド（黄金色）
     '期待': '#FFA07A',  # ライトサーモン
@@ -30,6 +34,109 @@ CHECKPOINT = {
     'MODEL': 'iton/YTLive-JaBERT-Emotion-v1'
 }
 
+APP_CACHE_DIR = Path.home() / '.cache' / 'jp-stream-chat-sentiment'
+
+# torch: PyTorch(fp32), torch-int8: PyTorchの動的int8量子化(CPUのみ), onnx: ONNX Runtime
+INFERENCE_BACKENDS = ('torch', 'torch-int8', 'onnx')
+
+# 感情分析時に一度にトークナイズするチャットの件数。長さ順の並べ替えもこの単位で行う
+TOKENIZE_CHUNK_SIZE = 4096
+
+# 複数プロセスで推論する際に、1回に各プロセスへ渡すバッチ数
+PARALLEL_CHUNK_BATCHES = 16
+
+# バッチサイズ・トークン数を自動で決める場合の設定。トークン数はチャットのPERCENTILE%が収まる長さにし、
+# バッチサイズはBATCH_SIZESの小さい順にPROBE_BATCHESバッチずつ推論して速度を計測して決める
+AUTO_TUNING = {
+    'PERCENTILE': 99,
+    'SAMPLE_SIZE': 5000,
+    'MAX_TOKEN_SIZE': 512,
+    'BATCH_SIZES': (8, 16, 32, 64, 128, 256, 512),
+    'PROBE_BATCHES': 4
+}
+AUTO_SIZE_LABEL = '自動'
+
+# 感情分析の途中結果を保存するファイル(保存先のパス + SUFFIX)と、保存する間隔(バッチ数)。
+# ダウンロードと並行して分析する場合は、ページ毎の結果をPAGES_SUFFIXのファイルに書き出す
+ANALYSIS_CHECKPOINT = {
+    'SUFFIX': '.checkpoint.npz',
+    'PAGES_SUFFIX': '.checkpoint.sqlite3',
+    'EVERY_BATCHES': 500
+}
+
+# 分析に使用したモデルを記録するメタデータのキー。記録と異なるモデルで分析する場合は全ての行を分析し直す
+EMOTION_MODEL_KEY = 'emotion_model'
+
+# 実行毎の段階別の時間やスループットを書き出すファイル(保存先のパス + SUFFIX)
+RUN_REPORT_SUFFIX = '.report.json'
+
+# Youtubeのチャットを解析したページを書き出すファイル(保存先のパス + SUFFIX)。
+# 最後までダウンロードした後に中断した場合は、ダウンロードし直さずにここから読み込む
+YOUTUBE_SPOOL_SUFFIX = '.youtube-pages.jsonl'
+
+EMOTION_CACHE = {
+    'PATH': str(APP_CACHE_DIR / 'emotion_cache.sqlite3'),
+    'MAX_ENTRIES': 2_000_000
+}
+
+TWITCH = {
+    'GQL_URL': 'https://gql.twitch.tv/gql',
+    'CLIENT_ID': 'kd1unb4b3q4t58fwlpcbzcbnm76a8fp',
+    'COMMENTS_QUERY_HASH': 'b70a3591ff0f4e0313d126c6a1502d79a1c02baebb288227c582044aa76adf6a',
+    # 動画を再生位置で区切り、並行してコメントを取得する
+    'MAX_WORKERS': 8,
+    'MAX_SHARDS': 32,
+    'MIN_SHARD_SECONDS': 600,
+    'TIMEOUT': 10,
+    # 5xx・429・通信エラーの場合は、指数的に伸ばした待ち時間(ジッター付き)の後に再試行する
+    'MAX_RETRIES': 6,
+    'BACKOFF_BASE': 0.5,
+    'BACKOFF_MAX': 30,
+    # ページ間の待ち時間。応答時間と429に応じてMIN_PAGE_INTERVALからMAX_PAGE_INTERVALの間で調整する
+    'PAGE_INTERVAL': 0.1,
+    'MIN_PAGE_INTERVAL': 0.02,
+    'MAX_PAGE_INTERVAL': 5.0,
+    # 応答時間がこれを超え、かつ直近の平均の2倍を超えた場合にページ間の待ち時間を伸ばす
+    'SLOW_LATENCY': 1.0,
+    # 取得したページを書き出すディレクトリ(保存先のパス + SPOOL_SUFFIX)。中断した場合はここから再開する
+    'SPOOL_SUFFIX': '.twitch-pages',
+    # 配信中のチャットはIRCで受信する。ログインせずに読み取り専用で接続する
+    'IRC_HOST': 'irc.chat.twitch.tv',
+    'IRC_PORT': 6667,
+    'IRC_NICK': 'justinfan12345'
+}
+
+# ライブ表示の設定。受信したチャットはLATENCY_SECONDS以内にまとめて分析し、秒毎の件数をWINDOW_SECONDS分保持する。
+# グラフにはBIN_SECONDS毎の区間を、遅れて届くチャットをLATE_SECONDS待ってから追加する
+LIVE = {
+    'LATENCY_SECONDS': 2.0,
+    'BIN_SECONDS': 10,
+    'WINDOW_SECONDS': 3600,
+    'LATE_SECONDS': 2,
+    'SUMMARY_SECONDS': 60,
+    'POLL_INTERVAL': 0.2
+}
+
+# 複数のURL・ファイルをまとめて処理する場合の設定。MAX_DOWNLOADSは同時に実行するジョブ数の既定値。
+# 共有の推論スレッドは1回にbatch_size * CHUNK_BATCHES件まで推論し、1バッチに満たない場合はFILL_WAIT秒だけ他のジョブを待つ
+JOB_QUEUE = {
+    'MAX_DOWNLOADS': 3,
+    'CHUNK_BATCHES': 16,
+    'FILL_WAIT': 0.05
+}
+
+JOB_STATUS = {
+    'PENDING': '待機中',
+    'RUNNING': '実行中',
+    'CANCELLING': 'キャンセル中...',
+    'COMPLETED': '完了',
+    'FAILED': 'エラー',
+    'CANCELLED': 'キャンセル済み'
+}
+
+# ダウンロードと感情分析を並行して行う際に、分析待ちとして保持するページ数の上限
+PIPELINE_QUEUE_SIZE = 32
+
 STEP_LABEL = {
     'MODEL_LOADING': 'モデルをロード中...',
     'MODEL_LOADED': 'モデルのロードが完了しました',
@@ -38,7 +145,17 @@ STEP_LABEL = {
     'COMPLETE': '完了！',
     'CONVERTING_CSV': 'csvファイルへの変換中...',
     'EMOTION_ANALYZE_PREPARE': '感情分析の準備中...',
-    'EMOTION_ANALYZING': '感情分析の実行中...'
+    'BACKEND_PREPARE': '推論エンジンの準備中...(初回のみ時間がかかります)',
+    'EMOTION_ANALYZING': '感情分析の実行中...',
+    'DOWNLOAD_AND_ANALYZE': 'チャットのダウンロードと感情分析を並行して実行中... ({count}件分析済み)',
+    'CACHE_STATS': '完了！ (キャッシュ ヒット: {hits}件 / ミス: {misses}件)',
+    'INCREMENTAL': '分析済みの{kept}件を再利用し、{count}件を分析します',
+    'AUTO_TUNING': 'バッチサイズとトークン数を計測中...',
+    'AUTO_TUNED': 'バッチサイズ: {batch_size} / トークン数: {token_size} で分析します',
+    'OUT_OF_MEMORY': 'メモリ不足のため、バッチサイズを{batch_size}に下げて続行します',
+    'LIVE_CONNECTING': 'ライブ配信に接続中...',
+    'LIVE_ANALYZING': 'ライブ配信のチャットを分析中... ({count}件分析済み)',
+    'LIVE_STOPPED': 'ライブ表示を終了しました ({count}件)'
 }
 
 BUTTON_LABEL = {
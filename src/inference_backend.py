@@ -0,0 +1,132 @@
+import copy
+import os
+import threading
+import time
+from types import SimpleNamespace
+
+import torch
+
+from constants import APP_CACHE_DIR, CHECKPOINT, INFERENCE_BACKENDS
+
+try:
+    import onnxruntime as ort
+except ImportError:
+    ort = None
+
+# 複数のスレッドから同時に取得されても、同じ推論エンジンを1度だけ作る
+backends_lock = threading.Lock()
+
+
+class LogitsOnly(torch.nn.Module):
+    # ONNXへのエクスポート用に、出力をlogitsのみにする
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, input_ids, attention_mask):
+        return self.model(input_ids=input_ids, attention_mask=attention_mask).logits
+
+
+class OnnxSequenceClassifier:
+    # predict_emotionsからはtransformersのモデルと同じように扱えるようにする
+    def __init__(self, path, config, device):
+        providers = ['CPUExecutionProvider']
+        if device.type == 'cuda' and 'CUDAExecutionProvider' in ort.get_available_providers():
+            providers.insert(0, 'CUDAExecutionProvider')
+        self.session = ort.InferenceSession(str(path), providers=providers)
+        self.config = config
+
+    def to(self, device):
+        return self
+
+    def eval(self):
+        return self
+
+    def __call__(self, input_ids, attention_mask):
+        logits, = self.session.run(['logits'], {
+            'input_ids': input_ids.cpu().numpy(),
+            'attention_mask': attention_mask.cpu().numpy()
+        })
+        return SimpleNamespace(logits=torch.from_numpy(logits))
+
+
+def onnx_model_path():
+    return APP_CACHE_DIR / 'onnx' / f"{CHECKPOINT['MODEL'].replace('/', '--')}.onnx"
+
+
+def export_onnx(model, path):
+    os.makedirs(path.parent, exist_ok=True)
+    dummy = torch.ones((1, 8), dtype=torch.long)
+    tmp_path = path.with_suffix('.tmp')
+    torch.onnx.export(
+        LogitsOnly(copy.deepcopy(model).cpu().eval()),
+        (dummy, dummy),
+        str(tmp_path),
+        input_names=['input_ids', 'attention_mask'],
+        output_names=['logits'],
+        dynamic_axes={
+            'input_ids': {0: 'batch', 1: 'sequence'},
+            'attention_mask': {0: 'batch', 1: 'sequence'},
+            'logits': {0: 'batch'}
+        },
+        opset_version=14
+    )
+    os.replace(tmp_path, path)
+
+
+def build_backend(model, backend, device):
+    if backend == 'torch':
+        # 読み込んだモデルはCPUに置いたまま共有し、他のデバイスではコピーを使う。
+        # 別のスレッドが推論している間にモデルのデバイスが変わらないようにする
+        if device.type == 'cpu':
+            return model
+        return copy.deepcopy(model).to(device).eval()
+    if backend == 'torch-int8':
+        # 動的量子化はCPUでのみ動作する
+        return torch.ao.quantization.quantize_dynamic(copy.deepcopy(model).cpu(), {torch.nn.Linear},
+                                                      dtype=torch.qint8)
+    if backend == 'onnx':
+        if ort is None:
+            raise RuntimeError('ONNX Runtimeを使用するにはonnxruntimeをインストールしてください')
+        path = onnx_model_path()
+        # 変換済みのモデルはディスクにキャッシュし、2回目以降は変換しない
+        if not path.exists():
+            export_onnx(model, path)
+        return OnnxSequenceClassifier(path, model.config, device)
+    raise ValueError(f'未対応の推論エンジンです: {backend}')
+
+
+def get_backend(nlp_components, backend, device):
+    # 変換したモデルは使い回すためnlp_componentsに保持する
+    with backends_lock:
+        backends = nlp_components.setdefault('backends', {})
+        key = (backend, device.type)
+        if key not in backends:
+            backends[key] = build_backend(nlp_components['model'], backend, device)
+        return backends[key]
+
+
+def backend_device(backend, device):
+    return torch.device('cpu') if backend == 'torch-int8' else device
+
+
+def compare_backends(texts, nlp_components, predict, device, backends=INFERENCE_BACKENDS):
+    # fp32のPyTorchモデルの結果を基準に、各推論エンジンの速度と結果の一致率を計測する
+    report = []
+    reference = None
+    for backend in ('torch',) + tuple(b for b in backends if b != 'torch'):
+        target_device = backend_device(backend, device)
+        model = get_backend(nlp_components, backend, target_device)
+        start = time.perf_counter()
+        labels = predict(texts, model, target_device)
+        elapsed = time.perf_counter() - start
+        if reference is None:
+            reference = labels
+        agreement = float((reference == labels).mean()) if len(texts) else 1.0
+        report.append({
+            'backend': backend,
+            'seconds': elapsed,
+            'chats_per_second': len(texts) / elapsed if elapsed else float('inf'),
+            'agreement': agreement
+        })
+    return report
@@ -0,0 +1,152 @@
+import hashlib
+import os
+import sqlite3
+import time
+import unicodedata
+
+import numpy as np
+
+# sqliteのプレースホルダ数の上限を超えないように分割して問い合わせる
+QUERY_CHUNK_SIZE = 500
+# 上限を超えた時は上限の9割まで削除し、上限付近で毎回削除が行われないようにする
+EVICT_RATIO = 0.9
+
+
+def normalize_chat(text):
+    # トークナイザもNFKC正規化を行うため、正規化後の文字列が同じなら推論結果も同じになる
+    return unicodedata.normalize('NFKC', text).strip()
+
+
+def text_hash(text):
+    return hashlib.sha1(text.encode('utf-8')).digest()
+
+
+class EmotionCache:
+    def __init__(self, path, model_name, max_entries):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.model_name = model_name
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        # 複数のジョブを同時に実行する場合は同じファイルに書き込むため、ロックの解放を長めに待つ
+        self.conn = sqlite3.connect(path, timeout=30)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS emotion_scores (
+                model TEXT NOT NULL,
+                text_hash BLOB NOT NULL,
+                code INTEGER NOT NULL,
+                scores BLOB NOT NULL,
+                accessed_at REAL NOT NULL,
+                PRIMARY KEY (model, text_hash)
+            )
+        """)
+        self.conn.execute('CREATE INDEX IF NOT EXISTS idx_accessed_at ON emotion_scores (accessed_at)')
+        self.conn.commit()
+        # 件数は開いた時に1度だけ数え、以降は追加した件数から見積もる
+        self.count = self.conn.execute('SELECT COUNT(*) FROM emotion_scores').fetchone()[0]
+
+    def get_many(self, texts):
+        hashes = {text_hash(text): text for text in texts}
+        keys = list(hashes)
+        found = {}
+        for i in range(0, len(keys), QUERY_CHUNK_SIZE):
+            chunk = keys[i:i + QUERY_CHUNK_SIZE]
+            rows = self.conn.execute(
+                f"SELECT text_hash, code, scores FROM emotion_scores WHERE model = ? "
+                f"AND text_hash IN ({','.join('?' * len(chunk))})",
+                [self.model_name, *chunk]
+            ).fetchall()
+            for key, code, scores in rows:
+                found[hashes[key]] = (code, np.frombuffer(scores, dtype=np.float16))
+        if found:
+            now = time.time()
+            self.conn.executemany(
+                'UPDATE emotion_scores SET accessed_at = ? WHERE model = ? AND text_hash = ?',
+                [(now, self.model_name, text_hash(text)) for text in found]
+            )
+            self.conn.commit()
+        self.hits += len(found)
+        self.misses += len(hashes) - len(found)
+        return found
+
+    def put_many(self, texts, codes, scores):
+        now = time.time()
+        self.conn.executemany(
+            'INSERT OR REPLACE INTO emotion_scores (model, text_hash, code, scores, accessed_at) '
+            'VALUES (?, ?, ?, ?, ?)',
+            [(self.model_name, text_hash(text), int(code), row.tobytes(), now)
+             for text, code, row in zip(texts, codes, scores)]
+        )
+        self.conn.commit()
+        # 置き換えた行も数えるため実際の件数以上の見積もりになる。上限を超えた時だけ数え直す
+        self.count += len(texts)
+        if self.count > self.max_entries:
+            self.evict()
+
+    def evict(self):
+        # 最後に参照された時刻が古いものから削除して件数を上限以下に保つ
+        count = self.conn.execute('SELECT COUNT(*) FROM emotion_scores').fetchone()[0]
+        if count > self.max_entries:
+            target = int(self.max_entries * EVICT_RATIO)
+            self.conn.execute(
+                'DELETE FROM emotion_scores WHERE rowid IN '
+                '(SELECT rowid FROM emotion_scores ORDER BY accessed_at LIMIT ?)',
+                (count - target,)
+            )
+            self.conn.commit()
+            count = target
+        self.count = count
+
+    def close(self):
+        self.conn.close()
+
+
+def classify_unique(texts, classify, n_labels, cache=None, make_checkpoint=None):
+    # 正規化後に同じ文字列となるチャットは1度だけ推論し、結果を全ての行に展開する
+    index = {}
+    inverse = np.fromiter((index.setdefault(normalize_chat(text), len(index)) for text in texts),
+                          dtype=np.int64, count=len(texts))
+    unique_texts = list(index)
+    codes = np.zeros(len(unique_texts), dtype=np.uint8)
+    scores = np.zeros((len(unique_texts), n_labels), dtype=np.float16)
+
+    cached = cache.get_many(unique_texts) if cache is not None else {}
+    for text, (code, row) in cached.items():
+        codes[index[text]] = code
+        scores[index[text]] = row
+
+    # 前回中断した時の途中結果があれば、推論済みのチャットはそれを使う
+    checkpoint = make_checkpoint(unique_texts) if make_checkpoint is not None else None
+    done = np.zeros(len(unique_texts), dtype=bool)
+    if checkpoint is not None:
+        done = checkpoint.done.copy()
+        codes[done] = checkpoint.codes[done]
+        scores[done] = checkpoint.scores[done]
+
+    uncached = [text for text in unique_texts if text not in cached]
+    misses = [text for text in uncached if not done[index[text]]]
+    if misses:
+        rows = np.array([index[text] for text in misses], dtype=np.int64)
+
+        def record(batch_rows, batch_codes, batch_scores):
+            checkpoint.record(rows[batch_rows], batch_codes, batch_scores)
+
+        on_result = record if checkpoint is not None else None
+        try:
+            miss_codes, miss_scores = classify(misses, on_result)
+        except BaseException:
+            # キャンセルやエラーで中断した場合も、それまでの結果は残しておく
+            if checkpoint is not None:
+                checkpoint.save()
+            raise
+        codes[rows] = miss_codes
+        scores[rows] = miss_scores
+
+    if uncached and cache is not None:
+        rows = [index[text] for text in uncached]
+        cache.put_many(uncached, codes[rows], scores[rows])
+    if checkpoint is not None:
+        checkpoint.remove()
+
+    return codes[inverse], scores[inverse]
@@ -0,0 +1,173 @@
+import json
+import os
+import time
+from array import array
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from archive import chat_array, seconds_array
+
+try:
+    import orjson
+    loads = orjson.loads
+except ImportError:
+    loads = json.loads
+
+CHUNK_SIZE = 1 << 20
+# テキストチャットを含まない行(メンバー加入、スーパーチャット等)はデコードせずに読み飛ばす
+TEXT_MESSAGE_KEY = b'liveChatTextMessageRenderer'
+
+
+def iter_line_batches(chunks):
+    # バイト列のチャンクを行に分割し、チャンク毎に完結した行のリストを返す。行の途中は次のチャンクに繋げる
+    rest = b''
+    for chunk in chunks:
+        lines = (rest + chunk).split(b'\n')
+        rest = lines.pop()
+        yield lines
+    if rest:
+        yield [rest]
+
+
+def iter_lines(file, chunk_size=CHUNK_SIZE):
+    for lines in iter_line_batches(iter(lambda: file.read(chunk_size), b'')):
+        yield from lines
+
+
+def read_chunk(path, offset, chunk_size):
+    # yt-dlpは.partに書き込み、完了後に名前を変えるため両方を見る
+    for current in (f'{path}.part', path):
+        try:
+            with open(current, 'rb') as file:
+                file.seek(offset)
+                return file.read(chunk_size)
+        except FileNotFoundError:
+            continue
+    return b''
+
+
+def follow_chunks(path, is_finished, check_cancelled, poll_interval=0.2, chunk_size=CHUNK_SIZE):
+    # 書き込み中のファイルを、増えた分だけ読み進める。
+    # 読み終わったチャンクを処理している間にyt-dlpが名前を変えられるよう、ファイルはチャンクを読む間だけ開く
+    offset = 0
+    while True:
+        # 書き込みが終わったかどうかを読む前に確認し、最後に書き込まれた分を読み逃さないようにする
+        finished = is_finished()
+        chunk = read_chunk(path, offset, chunk_size)
+        if chunk:
+            offset += len(chunk)
+            yield chunk
+        elif finished:
+            return
+        else:
+            check_cancelled()
+            time.sleep(poll_interval)
+
+
+def parse_live_chat_lines(lines, chats, seconds):
+    for line in lines:
+        if TEXT_MESSAGE_KEY not in line:
+            continue
+        record = loads(line)
+        replay = record.get('replayChatItemAction')
+        if replay is None:
+            continue
+        # 配信中のチャットは、yt-dlpが経過時間をreplayChatItemActionの外側に書き込む
+        offset = replay.get('videoOffsetTimeMsec', record.get('videoOffsetTimeMsec'))
+        # 1行に複数のアクションが含まれる場合があるため全て処理する
+        for action in replay['actions']:
+            add_chat_item = action.get('addChatItemAction')
+            if add_chat_item is None:
+                continue
+            renderer = add_chat_item['item'].get('liveChatTextMessageRenderer')
+            if renderer is None:
+                continue
+            message_runs = renderer['message']['runs']
+            if message_runs and 'text' in message_runs[0]:
+                chats.append(message_runs[0]['text'])
+                seconds.append(int(offset) // 1000)
+
+
+class PageSpool:
+    # 1行目にメタデータ、以降に解析したページを追記し、最後まで書き込めた場合は終わりの印を書く
+    def __init__(self, path):
+        self.path = path
+
+    def load_metadata(self, url):
+        # 同じURLのページが最後まで書き込まれている場合のみメタデータを返す
+        try:
+            with open(self.path, 'rb') as file:
+                header = file.readline()
+                file.seek(max(file.tell(), os.path.getsize(self.path) - 64))
+                tail = file.read().splitlines()
+            metadata = json.loads(header)
+            done = bool(tail) and json.loads(tail[-1]).get('done', False)
+        except (OSError, ValueError):
+            return None
+        if not done or metadata.get('url') != url:
+            return None
+        return metadata
+
+    def iter_pages(self):
+        with open(self.path, 'rb') as file:
+            file.readline()
+            for line in file:
+                record = loads(line)
+                if record.get('done'):
+                    return
+                yield record['chats'], array('q', record['seconds'])
+
+    def start(self, metadata):
+        # 途中で中断された前回のページは、ダウンロードし直すため破棄する
+        with open(self.path, 'w', encoding='utf-8') as file:
+            file.write(json.dumps(metadata, ensure_ascii=False) + '\n')
+
+    def append(self, chats, seconds):
+        with open(self.path, 'a', encoding='utf-8') as file:
+            file.write(json.dumps({'chats': chats, 'seconds': seconds.tolist()}, ensure_ascii=False) + '\n')
+
+    def finish(self):
+        with open(self.path, 'a', encoding='utf-8') as file:
+            file.write(json.dumps({'done': True}) + '\n')
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def parse_live_chat(path):
+    chats = []
+    seconds = array('q')
+    with open(path, 'rb') as file:
+        parse_live_chat_lines(iter_lines(file), chats, seconds)
+    return chats, seconds
+
+
+class ChatColumns:
+    # 受信したページのチャットをArrowの配列として溜め、全件分のPythonの文字列を同時に保持しないようにする
+    def __init__(self):
+        self.chunks = []
+        self.seconds = array('q')
+
+    def __len__(self):
+        return len(self.seconds)
+
+    def extend(self, chats, seconds):
+        if len(chats):
+            self.chunks.append(pa.array(chats, type=pa.large_string()))
+            self.seconds.extend(seconds)
+
+    def to_df(self):
+        # Twitchはページが小さく細切れになるため、1つの配列にまとめてから列にする
+        chats = pa.chunked_array(self.chunks, type=pa.large_string()).combine_chunks()
+        return columns_to_df(pa.chunked_array([chats]), self.seconds)
+
+
+def columns_to_df(chats, seconds):
+    return pd.DataFrame({'chat': chat_array(chats), 'second': seconds_array(np.frombuffer(seconds, dtype=np.int64))})
+
+
+def json_to_df(path):
+    return columns_to_df(*parse_live_chat(path))
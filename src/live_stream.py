@@ -0,0 +1,271 @@
+import os
+import queue
+import threading
+import time
+from array import array
+from contextlib import closing
+from urllib.parse import urlparse
+
+import numpy as np
+
+from archive import read_dataset
+from constants import ErrorCode, LIVE, PIPELINE_QUEUE_SIZE, STEP_LABEL
+from live_chat_parser import ChatColumns
+from pipeline import ChatAnalyzer, ProcessError, add_emotion_columns, label_names
+from twitch_client import iter_live_messages, sleep
+
+
+def replay_pages(path, check_cancelled, speed=1.0, poll_interval=LIVE['POLL_INTERVAL']):
+    # 保存済みのチャットを、配信中に届いたのと同じ間隔で少しずつ返す。ライブ表示をオフラインで確認するために使う
+    df, _ = read_dataset(path, columns=['chat', 'second'])
+    df = df.dropna().sort_values('second', kind='stable')
+    chats = df['chat'].astype(str).tolist()
+    seconds = df['second'].to_numpy(dtype=np.int64)
+    if not len(seconds):
+        return
+    # 最初のチャットから再生を始める
+    offset = seconds[0]
+    started = time.monotonic()
+    position = 0
+    while position < len(seconds):
+        now = offset + (time.monotonic() - started) * speed
+        end = int(np.searchsorted(seconds, now, side='right'))
+        if end > position:
+            yield chats[position:end], seconds[position:end].tolist()
+            position = end
+        sleep(poll_interval, check_cancelled)
+
+
+class EmotionRingBuffer:
+    # 直近capacity秒分の、秒 x 感情の件数。古い秒の位置は新しい秒で上書きする
+    def __init__(self, capacity, n_labels):
+        self.capacity = capacity
+        self.counts = np.zeros((capacity, n_labels), dtype=np.int32)
+        # 保持している最後の秒 + 1
+        self.end = 0
+
+    def advance(self, end):
+        if end <= self.end:
+            return
+        if end - self.end >= self.capacity:
+            self.counts[:] = 0
+        else:
+            self.counts[np.arange(self.end, end) % self.capacity] = 0
+        self.end = end
+
+    def add(self, seconds, codes):
+        seconds = np.asarray(seconds, dtype=np.int64)
+        if not len(seconds):
+            return
+        self.advance(int(seconds.max()) + 1)
+        # 保持している範囲より古いチャットは数えない
+        keep = seconds >= self.end - self.capacity
+        np.add.at(self.counts, (seconds[keep] % self.capacity, np.asarray(codes)[keep]), 1)
+
+    def window(self, start, end):
+        # [start, end)の秒毎の件数。保持していない秒は0とする
+        seconds = np.arange(start, end)
+        matrix = np.zeros((len(seconds), self.counts.shape[1]), dtype=np.int32)
+        valid = (seconds >= self.end - self.capacity) & (seconds < self.end)
+        matrix[valid] = self.counts[seconds[valid] % self.capacity]
+        return matrix
+
+
+class LiveChatAnalyzer(ChatAnalyzer):
+    # 配信中のチャットを受信しながら少しずつ感情分析し、区間毎の件数をon_binsに渡す。
+    # sourceには配信中のYoutube・TwitchのURLか、リプレイする保存済みのファイルを指定する
+    def __init__(self, save_path, source, device, batch_size, token_size, nlp_components, speed=1.0,
+                 latency=LIVE['LATENCY_SECONDS'], bin_seconds=LIVE['BIN_SECONDS'],
+                 window_seconds=LIVE['WINDOW_SECONDS'], on_bins=None, **kwargs):
+        self.replay = os.path.isfile(source)
+        super().__init__(save_path, '' if self.replay else source, False, device, batch_size, token_size,
+                         nlp_components, input_path=source if self.replay else None, processes=1, **kwargs)
+        self.source = source
+        self.speed = speed if self.replay else 1.0
+        self.latency = latency
+        self.bin_seconds = bin_seconds
+        self.window_seconds = window_seconds
+        self.on_bins = on_bins
+        self.metrics.info.update(mode='live', speed=self.speed, latency_target=latency)
+
+    def page_source(self, metadata):
+        parsed_url = urlparse(self.source)
+        if self.replay:
+            metadata['replay'] = os.path.abspath(self.source)
+            return replay_pages(self.source, self.check_cancelled, self.speed)
+        if 'youtube' in parsed_url.netloc:
+            # yt-dlpは配信中のチャットも同じ形式で書き込むため、アーカイブと同じく書き込み中のファイルを読み進める
+            return self.iter_youtube_pages(metadata)
+        if 'twitch' in parsed_url.netloc:
+            channel = parsed_url.path.strip('/').split('/')[0]
+            metadata['url'] = f'https://www.twitch.tv/{channel}'
+            return iter_live_messages(channel, self.check_cancelled)
+        raise ProcessError('配信中のYoutubeかTwitchのURL、または保存済みのファイルを指定してください')
+
+    def run(self):
+        status = 'failed'
+        try:
+            self.process_step(STEP_LABEL['LIVE_CONNECTING'])
+            self.prepare_analysis()
+            metadata = {'url': self.url}
+            df = self.receive_and_classify(self.page_source(metadata))
+            if self.save_path:
+                self.save(metadata, df)
+            status = 'stopped' if self.stop_requested() else 'completed'
+            self.emit_step(STEP_LABEL['LIVE_STOPPED'].format(count=len(df)))
+            return df, metadata
+        except ProcessError as e:
+            if e.code == ErrorCode['CANCEL']:
+                status = 'cancelled'
+            raise
+        finally:
+            if self.cache is not None:
+                self.cache.close()
+            if self.save_path:
+                self.write_report(status)
+
+    def stop_requested(self):
+        return self.is_cancelled is not None and self.is_cancelled()
+
+    def receive_and_classify(self, page_source):
+        # 停止するまで受信を続ける。停止した場合もそこまでに受信したチャットは分析して返す
+        pages = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+        stopped = threading.Event()
+
+        def put(item):
+            while not stopped.is_set():
+                try:
+                    pages.put(item, timeout=0.5)
+                    return
+                except queue.Full:
+                    pass
+
+        def produce():
+            try:
+                with closing(page_source):
+                    for page in page_source:
+                        if stopped.is_set():
+                            return
+                        put(page)
+                put(None)
+            except Exception as e:
+                put(e)
+
+        producer = threading.Thread(target=produce, daemon=True)
+        producer.start()
+
+        names = label_names(self.nlp_components['model'])
+        self.buffer = EmotionRingBuffer(self.window_seconds, len(names))
+        self.names = names
+        # グラフに追加済みの区間の終わりの秒と、チャットから推定した配信の現在の秒
+        self.emitted_until = None
+        self.latest_second = None
+        self.latest_at = None
+        latencies = array('d')
+
+        columns, codes, scores = ChatColumns(), [], []
+        pending_chats, pending_seconds = [], []
+        first_arrival = None
+        finished = False
+        try:
+            while not finished:
+                if self.stop_requested():
+                    break
+                # 分析待ちのチャットがある場合は、目標の遅延を超えないところまでだけ待つ
+                timeout = LIVE['POLL_INTERVAL']
+                if first_arrival is not None:
+                    timeout = min(timeout, max(0.0, first_arrival + self.latency - time.monotonic()))
+                try:
+                    page = pages.get(timeout=timeout)
+                except queue.Empty:
+                    page = ()
+                if page is None:
+                    finished = True
+                elif isinstance(page, Exception):
+                    if self.stop_requested():
+                        break
+                    raise page
+                elif page:
+                    pending_chats.extend(page[0])
+                    pending_seconds.extend(page[1])
+                    if first_arrival is None:
+                        first_arrival = time.monotonic()
+
+                due = first_arrival is not None and time.monotonic() >= first_arrival + self.latency
+                if pending_chats and (finished or due or len(pending_chats) >= self.batch_size):
+                    page_codes, page_scores = self.classify_live(pending_chats, pending_seconds)
+                    latencies.append(time.monotonic() - first_arrival)
+                    codes.append(page_codes)
+                    scores.append(page_scores)
+                    columns.extend(pending_chats, pending_seconds)
+                    pending_chats, pending_seconds = [], []
+                    first_arrival = None
+                    self.emit_step(STEP_LABEL['LIVE_ANALYZING'].format(count=len(columns)))
+                self.emit_closed_bins(flush=finished)
+            # 停止した時点で受信済みのチャットも分析し、保存する結果に含める
+            if pending_chats:
+                page_codes, page_scores = self.classify_live(pending_chats, pending_seconds)
+                codes.append(page_codes)
+                scores.append(page_scores)
+                columns.extend(pending_chats, pending_seconds)
+            self.emit_closed_bins(flush=True)
+        finally:
+            stopped.set()
+
+        if latencies:
+            self.metrics.info.update(latency_p50_seconds=float(np.percentile(latencies, 50)),
+                                     latency_p95_seconds=float(np.percentile(latencies, 95)))
+        df = columns.to_df()
+        add_emotion_columns(
+            df,
+            np.concatenate(codes) if codes else np.zeros(0, dtype=np.uint8),
+            np.concatenate(scores) if scores else np.zeros((0, len(names)), dtype=np.float16),
+            names
+        )
+        return df.sort_values('second', kind='stable', ignore_index=True)
+
+    def classify_live(self, texts, text_seconds):
+        with self.metrics.stage('classify'):
+            page_codes, page_scores = self.classify_unique_texts(
+                texts, self.batch_size, self.token_size, self.device, on_batch=self.on_live_batch_finished
+            )
+        self.metrics.count('classify', rows=len(texts), micro_batches=1)
+        self.buffer.add(text_seconds, page_codes)
+        latest = max(text_seconds)
+        if self.latest_second is None or latest >= self.latest_second:
+            self.latest_second, self.latest_at = latest, time.monotonic()
+        if self.emitted_until is None:
+            self.emitted_until = min(text_seconds) // self.bin_seconds * self.bin_seconds
+        return page_codes, page_scores
+
+    def on_live_batch_finished(self, done, total):
+        # 停止した後も受信済みのチャットは分析し終えるため、ここではキャンセルを確認しない
+        pass
+
+    def emit_closed_bins(self, flush=False):
+        if self.emitted_until is None:
+            return
+        # 最後のチャットから経過した時間だけ配信が進んだとみなし、遅れて届くチャットを待ってから区間を閉じる
+        now = self.latest_second + (time.monotonic() - self.latest_at) * self.speed
+        if flush:
+            now = self.buffer.end + self.bin_seconds - 1
+        else:
+            now -= LIVE['LATE_SECONDS']
+        closed_until = int(now) // self.bin_seconds * self.bin_seconds
+        if closed_until <= self.emitted_until:
+            return
+        self.buffer.advance(closed_until)
+        start = max(self.emitted_until, closed_until - self.window_seconds // self.bin_seconds * self.bin_seconds)
+        counts = self.buffer.window(start, closed_until)
+        bins = counts.reshape(-1, self.bin_seconds, counts.shape[1]).sum(axis=1)
+        recent = self.buffer.window(closed_until - LIVE['SUMMARY_SECONDS'], closed_until).sum(axis=0)
+        self.emitted_until = closed_until
+        if self.on_bins is not None:
+            # 区間を閉じた後に届いたチャットは保存する結果には含まれるが、グラフには反映しない
+            self.on_bins({
+                'start': start,
+                'bin_seconds': self.bin_seconds,
+                'names': self.names,
+                'counts': bins,
+                'recent': recent,
+            })
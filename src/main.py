@@ -1,12 +1,20 @@
-import sys
+import time
 
-from PySide6.QtGui import QIcon
-from PySide6.QtWidgets import QApplication, QMainWindow, QWidget, QVBoxLayout, QTabWidget
+STARTED_AT = time.perf_counter()
 
-from src.constants import COMMON_STYLE
-from src.tabs.tab1 import Tab1Widget
-from src.tabs.tab2 import Tab2Widget
-from src.utils import Store
+import sys  # noqa: E402
+
+from PySide6.QtCore import Qt, QCoreApplication  # noqa: E402
+from PySide6.QtGui import QIcon  # noqa: E402
+from PySide6.QtWidgets import QApplication, QMainWindow, QWidget, QVBoxLayout, QTabWidget  # noqa: E402
+
+from src.constants import COMMON_STYLE  # noqa: E402
+from src.store import Store  # noqa: E402
+from src.tabs.tab1 import Tab1Widget  # noqa: E402
+from src.tabs.tab2 import Tab2Widget  # noqa: E402
+from src.tabs.tab3 import Tab3Widget  # noqa: E402
+
+IMPORTED_AT = time.perf_counter()
 
 
 class MainWindow(QMainWindow):
@@ -29,12 +37,18 @@ class MainWindow(QMainWindow):
         tab_widget.setDocumentMode(True)
         main_layout.addWidget(tab_widget)
 
-        tab1 = Tab1Widget(self.store)
-        tab_widget.addTab(tab1, 'ダウンロード')
+        self.tab1 = Tab1Widget(self.store)
+        tab_widget.addTab(self.tab1, 'ダウンロード')
 
         self.tab2 = Tab2Widget(self.store)
         tab_widget.addTab(self.tab2, 'グラフの表示')
 
+        # モデルはダウンロードタブでロードしたものを共有する
+        self.tab3 = Tab3Widget()
+        tab_widget.addTab(self.tab3, 'まとめて処理')
+        self.tab1.model_loader.finished.connect(self.tab3.on_model_loaded)
+        self.tab1.model_loader.finished.connect(self.tab2.on_model_loaded)
+
         tab_widget.currentChanged.connect(self.tab_changed)
 
         self.setStyleSheet(COMMON_STYLE)
@@ -45,9 +59,26 @@ class MainWindow(QMainWindow):
             self.tab2.update_plot_from_store()
 
 
+def print_startup_report(timings):
+    # python src/main.py --startup-report で起動時間の内訳を表示する
+    print('起動時間の内訳:', file=sys.stderr)
+    for label, seconds in timings:
+        print(f'  {label:<40}{seconds:8.3f}s', file=sys.stderr)
+    print(f"  {'起動からモデルのロード完了まで':<40}{time.perf_counter() - STARTED_AT:8.3f}s", file=sys.stderr)
+
+
 if __name__ == '__main__':
+    # QtWebEngineはグラフを表示する時に読み込むため、QApplicationの作成前に設定しておく
+    QCoreApplication.setAttribute(Qt.ApplicationAttribute.AA_ShareOpenGLContexts)
     app = QApplication(sys.argv)
     app.setStyle('Fusion')
+    window_started_at = time.perf_counter()
     window = MainWindow()
     window.show()
+    startup_timings = [
+        ('モジュールの読み込み(Qt, 画面)', IMPORTED_AT - STARTED_AT),
+        ('ウィンドウの作成と表示', time.perf_counter() - window_started_at),
+    ]
+    if '--startup-report' in sys.argv:
+        window.tab1.model_loader.timings.connect(lambda timings: print_startup_report(startup_timings + timings))
     sys.exit(app.exec())
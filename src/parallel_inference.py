@@ -0,0 +1,85 @@
+import multiprocessing
+import os
+
+import numpy as np
+import torch
+
+from constants import PARALLEL_CHUNK_BATCHES
+from inference_backend import get_backend
+from tokenization import count_batches
+
+# ワーカープロセス毎に保持するトークナイザとモデル
+replica = None
+
+
+def smt_active():
+    # Linux以外ではSMT(ハイパースレッディング)が有効か分からないため、無効とみなす
+    try:
+        with open('/sys/devices/system/cpu/smt/active') as file:
+            return file.read().strip() == '1'
+    except OSError:
+        return False
+
+
+def physical_cores():
+    # このプロセスが使える論理CPUの数から、SMTが有効な場合は1コアあたり2スレッドとして物理コア数を求める
+    try:
+        logical = len(os.sched_getaffinity(0))
+    except AttributeError:
+        logical = os.cpu_count() or 1
+    return max(1, logical // 2 if smt_active() else logical)
+
+
+def threads_per_process(processes):
+    # 物理コアを各プロセスに均等に割り当て、プロセス間でスレッドが取り合わないようにする
+    return max(1, physical_cores() // processes)
+
+
+def init_replica(backend, threads):
+    global replica
+    from pipeline import load_nlp_components
+
+    torch.set_num_threads(threads)
+    torch.set_num_interop_threads(1)
+    nlp_components = load_nlp_components()
+    replica = (nlp_components['tokenizer'], get_backend(nlp_components, backend, torch.device('cpu')))
+
+
+def predict_chunk(args):
+    from pipeline import predict_emotions
+
+    texts, batch_size, token_size, dynamic_padding = args
+    tokenizer, model = replica
+    return predict_emotions(texts, tokenizer, model, batch_size, token_size, torch.device('cpu'),
+                            dynamic_padding=dynamic_padding)
+
+
+def predict_emotions_parallel(texts, processes, batch_size, token_size, n_labels, backend='torch',
+                              dynamic_padding=True, on_batch=None, on_result=None):
+    # チャットを一定件数毎に分割して各プロセスのモデルで推論し、元の順番に結合する
+    chunk_size = batch_size * PARALLEL_CHUNK_BATCHES
+    chunks = [texts[i:i + chunk_size] for i in range(0, len(texts), chunk_size)]
+    if not chunks:
+        return np.zeros(0, dtype=np.uint8), np.zeros((0, n_labels), dtype=np.float16)
+    chunk_batches = [count_batches(len(chunk), batch_size, dynamic_padding) for chunk in chunks]
+    total_batches = sum(chunk_batches)
+
+    codes = []
+    scores = []
+    done = 0
+    context = multiprocessing.get_context('spawn')
+    # withを抜ける時(キャンセル時を含む)にワーカープロセスは終了される
+    with context.Pool(processes, initializer=init_replica,
+                      initargs=(backend, threads_per_process(processes))) as pool:
+        results = pool.imap(predict_chunk, [(chunk, batch_size, token_size, dynamic_padding) for chunk in chunks])
+        offset = 0
+        for batches, (chunk_codes, chunk_scores) in zip(chunk_batches, results):
+            codes.append(chunk_codes)
+            scores.append(chunk_scores)
+            if on_result is not None:
+                on_result(np.arange(offset, offset + len(chunk_codes)), chunk_codes, chunk_scores)
+            offset += len(chunk_codes)
+            done += batches
+            if on_batch is not None:
+                on_batch(done, total_batches)
+    return np.concatenate(codes), np.concatenate(scores)
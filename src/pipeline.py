@@ -0,0 +1,695 @@
+import os
+import queue
+import shutil
+import threading
+import time
+from array import array
+from contextlib import closing
+from pathlib import Path
+from urllib.parse import urlparse, parse_qs
+
+import numpy as np
+import pandas as pd
+import torch
+from transformers import AutoModelForSequenceClassification, AutoTokenizer
+
+from analysis_checkpoint import AnalysisCheckpoint
+from archive import read_dataset, save_dataset
+from auto_tuning import choose_token_size, predict_with_backoff, probe_batch_size, sample_texts, token_lengths
+from constants import (ErrorCode, ERROR_MESSAGE, ANALYSIS_CHECKPOINT, APP_CACHE_DIR, AUTO_TUNING, CHECKPOINT,
+                       STEP_LABEL, EMOTION_CACHE, EMOTION_MODEL_KEY, EMOTION_NAMES, PIPELINE_QUEUE_SIZE,
+                       RUN_REPORT_SUFFIX, SCORE_COLUMN_PREFIX, TWITCH, YOUTUBE_SPOOL_SUFFIX)
+from inference_backend import backend_device, get_backend
+from inference_cache import EmotionCache, classify_unique
+from live_chat_parser import ChatColumns, PageSpool, follow_chunks, iter_line_batches, parse_live_chat_lines
+from parallel_inference import predict_emotions_parallel
+from run_metrics import RunMetrics
+from tokenization import count_batches, iter_batches
+from twitch_client import fetch_comment_pages, remove_spool
+
+
+def download_chats(url, path, hook, on_info=None):
+    # yt-dlpの読み込みは時間がかかるため、Youtubeのチャットをダウンロードする時まで遅らせる
+    from yt_dlp import YoutubeDL
+
+    output_path = str(Path(path) / '%(id)s')
+
+    with (YoutubeDL({
+        'format': 'best',
+        'outtmpl': output_path,
+        'writesubtitles': True,
+        'skip_download': True,
+        'noprogress': True,
+        'progress_hooks': [hook]
+    }) as ydl):
+        res = ydl.extract_info(url, download=False)
+        if on_info is not None:
+            on_info(res)
+        ydl.download([url])
+
+    return res
+
+
+class ProcessError(Exception):
+    def __init__(self, message='', code=ErrorCode['UNKNOWN']):
+        self.message = message
+        self.code = code
+
+    def __str__(self):
+        return self.message
+
+
+def select_device(force_cpu):
+    if force_cpu:
+        return torch.device('cpu')
+    return torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+
+
+def prepared_model_dir():
+    return APP_CACHE_DIR / 'prepared' / CHECKPOINT['MODEL'].replace('/', '--')
+
+
+def load_nlp_components(timings=None):
+    # 初回はHugging Faceから読み込み、トークナイザとモデルをsafetensors形式でローカルに保存する。
+    # 2回目以降はローカルのファイルをメモリマップで読み込むため、通信もチェックポイントの変換も発生しない
+    prepared_dir = prepared_model_dir()
+    prepared = prepared_dir.exists()
+    source = {'TOKENIZER': prepared_dir, 'MODEL': prepared_dir} if prepared else CHECKPOINT
+
+    start = time.perf_counter()
+    tokenizer = AutoTokenizer.from_pretrained(source['TOKENIZER'], clean_up_tokenization_spaces=True,
+                                              local_files_only=prepared)
+    tokenizer_loaded = time.perf_counter()
+    # low_cpu_mem_usageはaccelerateが必要になるため指定しない。safetensorsの読み込み自体はメモリマップで行われる
+    model = AutoModelForSequenceClassification.from_pretrained(source['MODEL'], local_files_only=prepared)
+    model_loaded = time.perf_counter()
+    if timings is not None:
+        timings.append(('トークナイザの読み込み', tokenizer_loaded - start))
+        timings.append(('モデルの読み込み' + ('(ローカルキャッシュ)' if prepared else ''), model_loaded - tokenizer_loaded))
+
+    if not prepared:
+        save_prepared_model(tokenizer, model, prepared_dir)
+    return {'tokenizer': tokenizer, 'model': model}
+
+
+def save_prepared_model(tokenizer, model, prepared_dir):
+    tmp_dir = prepared_dir.with_name(prepared_dir.name + '.tmp')
+    try:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        model.save_pretrained(tmp_dir, safe_serialization=True)
+        tokenizer.save_pretrained(tmp_dir)
+        os.replace(tmp_dir, prepared_dir)
+    except OSError:
+        # 保存できなくても次回もHugging Faceから読み込むだけなので処理は続ける
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def default_file_name(url, extension='.parquet'):
+    # 保存先が指定されていない場合に、URLから動画IDを取り出してファイル名にする
+    parsed_url = urlparse(url)
+    video_id = parse_qs(parsed_url.query).get('v', [None])[0] or parsed_url.path.rstrip('/').split('/')[-1]
+    return f'{video_id}{extension}'
+
+
+def output_path(source, out_dir, extension):
+    # ファイルを分析する場合は同じ名前で、URLの場合は動画のIDを名前にして保存する
+    if os.path.isfile(source):
+        file_name = os.path.splitext(os.path.basename(source))[0] + extension
+    else:
+        file_name = default_file_name(source, extension)
+    return os.path.join(out_dir, file_name)
+
+
+class ChatAnalyzer:
+    def __init__(self, save_path, url, skip_analyze, device, batch_size, token_size, nlp_components,
+                 dynamic_padding=True, use_cache=True, input_path=None, twitch_api_url=TWITCH['GQL_URL'],
+                 backend='torch', processes=1, incremental=True, length_percentile=AUTO_TUNING['PERCENTILE'],
+                 on_step=None, on_progress=None, is_cancelled=None, on_metrics=None, executor=None):
+        # 複数のジョブでモデルを共有する場合は、推論の設定を共有の推論スレッドに揃える
+        self.executor = executor
+        if executor is not None:
+            device, batch_size, token_size = executor.device, executor.batch_size, executor.token_size
+            dynamic_padding, backend, processes = executor.dynamic_padding, executor.backend, 1
+        self.save_path = save_path
+        self.url = url
+        self.skip_analyze = skip_analyze
+        self.backend = backend
+        self.device = backend_device(backend, device)
+        # 複数プロセスでの推論はCPUの場合のみ行う
+        self.processes = processes if self.device.type == 'cpu' else 1
+        # Noneの場合は分析するチャットに合わせて自動で決める
+        self.batch_size = batch_size
+        self.token_size = token_size
+        self.length_percentile = length_percentile
+        self.nlp_components = nlp_components
+        if nlp_components is not None:
+            self.tokenizer = nlp_components['tokenizer']
+            self.model = nlp_components['model']
+        self.dynamic_padding = dynamic_padding
+        self.use_cache = use_cache
+        self.cache = None
+        self.incremental = incremental
+        self.twitch_api_url = twitch_api_url
+        self.on_step = on_step
+        self.on_progress = on_progress
+        self.is_cancelled = is_cancelled
+        self.on_metrics = on_metrics
+        # 動画の長さの内、ダウンロードし終えた割合。長さが分からない場合はNone
+        self.download_fraction = None
+
+        # 既存のファイルが指定された場合はダウンロードせずにそのファイルを分析する
+        self.input_path = input_path or save_path
+        self.skip_download = os.path.exists(self.input_path)
+
+        self.metrics = RunMetrics(
+            url=url, input_path=self.input_path if self.skip_download else None, save_path=save_path,
+            backend=backend, device=str(self.device), batch_size=batch_size, token_size=token_size,
+            processes=self.processes, dynamic_padding=dynamic_padding
+        )
+
+    def run(self):
+        status = 'failed'
+        try:
+            parsed_url = urlparse(self.url)
+            classified = False
+            if self.skip_download:
+                with self.metrics.stage('read'):
+                    df, metadata = read_dataset(self.input_path)
+                self.metrics.count('read', rows=len(df), bytes=os.path.getsize(self.input_path))
+            else:
+                self.process_step(STEP_LABEL['DOWNLOAD_PREPARE'])
+                if 'youtube' in parsed_url.netloc:
+                    if self.overlap_analysis():
+                        self.prepare_analysis()
+                        metadata = {'url': self.url}
+                        df = self.download_and_classify(self.iter_youtube_pages(metadata))
+                        classified = True
+                    else:
+                        df, metadata = self.download_youtube_chats()
+                elif 'twitch' in parsed_url.netloc:
+                    video_id = parsed_url.path.split('/')[-1]
+                    if self.overlap_analysis():
+                        self.prepare_analysis()
+                        metadata = {'url': f"https://www.twitch.tv/videos/{video_id}"}
+                        df = self.download_and_classify(self.fetch_twitch_pages(video_id))
+                        classified = True
+                    else:
+                        df, metadata = self.download_twitch_chats(video_id)
+                else:
+                    raise ProcessError('YoutubeかTwitchのURLを入力してください')
+
+            if not self.skip_analyze:
+                if not classified:
+                    self.classify_stale_rows(df, metadata)
+                metadata[EMOTION_MODEL_KEY] = self.model_fingerprint()
+                self.save(metadata, df)
+                if classified:
+                    # ダウンロードと並行して分析した場合は、保存できた時点で再開用のページと途中結果が不要になる
+                    remove_spool(self.twitch_spool_dir())
+                    PageSpool(self.youtube_spool_path()).remove()
+                    if os.path.exists(self.page_checkpoint_path()):
+                        os.remove(self.page_checkpoint_path())
+            status = 'completed'
+            return df, metadata
+        except ProcessError as e:
+            if e.code == ErrorCode['CANCEL']:
+                status = 'cancelled'
+            raise
+        finally:
+            if self.cache is not None:
+                self.cache.close()
+            self.write_report(status)
+
+    def overlap_analysis(self):
+        # 複数プロセスで推論する場合は、ページ毎にプロセスを起動しないよう全て取得してから分析する。
+        # バッチサイズ等を自動で決める場合も、全てのチャットを見てから決めるため同様にする
+        return not self.skip_analyze and self.processes == 1 and not self.auto_tuning()
+
+    def save(self, metadata, df):
+        with self.metrics.stage('save'):
+            save_dataset(self.save_path, metadata, df)
+        self.metrics.count('save', rows=len(df), bytes=os.path.getsize(self.save_path))
+
+    def write_report(self, status):
+        # 実行の記録は保存先の隣に書き出す。書き出せなくても分析結果には影響しないため処理は続ける
+        try:
+            report = self.metrics.write(f'{self.save_path}{RUN_REPORT_SUFFIX}', status)
+        except OSError:
+            report = self.metrics.report(status)
+        if self.on_metrics is not None:
+            self.on_metrics(report)
+
+    def prepare_analysis(self):
+        if self.executor is None and self.backend != 'torch':
+            self.process_step(STEP_LABEL['BACKEND_PREPARE'])
+        # 共有の推論スレッドで推論する場合も、バッチサイズの計測はこのスレッドのモデルで行う
+        self.model = get_backend(self.nlp_components, self.backend, self.device)
+        self.open_cache()
+
+    def open_cache(self):
+        # キャッシュはトークン数毎に分けるため、自動で決める場合は決まってから開く
+        if self.use_cache and self.cache is None and self.token_size is not None:
+            self.cache = EmotionCache(EMOTION_CACHE['PATH'], self.model_name(), EMOTION_CACHE['MAX_ENTRIES'])
+
+    def classify_stale_rows(self, df, metadata):
+        names = label_names(self.nlp_components['model'])
+        if self.incremental and self.token_size is None:
+            # トークン数を自動で決める場合は、前回の分析と同じトークン数を使えば分析済みの行をそのまま使える
+            recorded = metadata.get(EMOTION_MODEL_KEY)
+            if isinstance(recorded, dict) and recorded == dict(self.model_fingerprint(),
+                                                               token_size=recorded.get('token_size')):
+                self.token_size = recorded['token_size']
+        if self.incremental:
+            stale = stale_rows(df, metadata, self.model_fingerprint(), names)
+        else:
+            stale = np.ones(len(df), dtype=bool)
+        count = int(stale.sum())
+        if count < len(df):
+            self.emit_step(STEP_LABEL['INCREMENTAL'].format(kept=len(df) - count, count=count))
+
+        codes = np.zeros(len(df), dtype=np.uint8)
+        scores = np.zeros((len(df), len(names)), dtype=np.float16)
+        if count < len(df):
+            kept = ~stale
+            codes[kept] = pd.Categorical(df['emotion'][kept], categories=names).codes
+            scores[kept] = df[score_columns(names)][kept].to_numpy(dtype=np.float16)
+        if count:
+            self.prepare_analysis()
+            texts = df['chat'][stale].tolist()
+            self.tune(texts)
+            with self.metrics.stage('classify'):
+                codes[stale], scores[stale] = self.classify_emotions(
+                    texts, self.batch_size, self.token_size, self.device
+                )
+            self.metrics.count('classify', rows=count)
+        add_emotion_columns(df, codes, scores, names)
+
+    def auto_tuning(self):
+        return self.batch_size is None or self.token_size is None
+
+    def tune(self, texts):
+        if not self.auto_tuning():
+            return
+        self.process_step(STEP_LABEL['AUTO_TUNING'])
+        max_token_size = min(AUTO_TUNING['MAX_TOKEN_SIZE'], self.tokenizer.model_max_length)
+        with self.metrics.stage('tune'):
+            sample = sample_texts(texts, AUTO_TUNING['SAMPLE_SIZE'])
+            lengths = token_lengths(sample, self.tokenizer, max_token_size)
+            if self.token_size is None:
+                self.token_size = choose_token_size(lengths, self.length_percentile, max_token_size)
+            if self.batch_size is None:
+                longest = [sample[i] for i in np.argsort(lengths)[::-1]]
+                self.batch_size = probe_batch_size(longest, self.probe, AUTO_TUNING['BATCH_SIZES'],
+                                                   AUTO_TUNING['PROBE_BATCHES'])
+        self.metrics.info.update(batch_size=self.batch_size, token_size=self.token_size)
+        self.open_cache()
+        self.emit_step(STEP_LABEL['AUTO_TUNED'].format(batch_size=self.batch_size, token_size=self.token_size))
+
+    def probe(self, texts, batch_size):
+        # 複数プロセスで推論する場合も、計測はこのプロセスのモデルで行う
+        self.check_cancelled()
+        predict_emotions(texts, self.tokenizer, self.model, batch_size, self.token_size, self.device,
+                         dynamic_padding=self.dynamic_padding)
+
+    def on_out_of_memory(self, batch_size):
+        self.batch_size = batch_size
+        self.metrics.info['batch_size'] = batch_size
+        self.metrics.count('classify', out_of_memory=1)
+        self.emit_step(STEP_LABEL['OUT_OF_MEMORY'].format(batch_size=batch_size))
+
+    def model_fingerprint(self):
+        # 分析結果に影響するモデル・トークナイザ・推論エンジン・トークン数をアーカイブに記録する
+        return {
+            'model': CHECKPOINT['MODEL'],
+            'tokenizer': CHECKPOINT['TOKENIZER'],
+            'backend': self.backend,
+            'token_size': self.token_size,
+            'labels': label_names(self.nlp_components['model']),
+        }
+
+    def model_name(self):
+        # 推論エンジンによって結果が僅かに異なる場合があり、また長いチャットはトークン数で切り詰められるため、
+        # キャッシュ等は推論エンジンとトークン数毎に分ける
+        name = CHECKPOINT['MODEL'] if self.backend == 'torch' else f"{CHECKPOINT['MODEL']}:{self.backend}"
+        return f'{name}:{self.token_size}'
+
+    def complete_label(self):
+        if self.cache is not None:
+            return STEP_LABEL['CACHE_STATS'].format(hits=self.cache.hits, misses=self.cache.misses)
+        return STEP_LABEL['COMPLETE']
+
+    def download_youtube_chats(self):
+        metadata = {'url': self.url}
+        columns = ChatColumns()
+        # downloadは書き込み中のファイルの解析を含めた時間、parseはその内の解析の時間を記録する
+        with self.metrics.stage('download'):
+            for page_chats, page_seconds in self.iter_youtube_pages(metadata):
+                columns.extend(page_chats, page_seconds)
+        self.metrics.count('download', rows=len(columns))
+
+        df = columns.to_df()
+        self.save(metadata, df)
+        PageSpool(self.youtube_spool_path()).remove()
+        return df, metadata
+
+    def iter_youtube_pages(self, metadata):
+        # yt-dlpが別スレッドでチャットのファイルに書き込んでいる間に、増えた分を読み進めて解析する。
+        # 全体を書き終わるのを待たず、メモリ上にも解析済みの列しか保持しない
+        self.metrics.info['source'] = 'youtube'
+        spool = PageSpool(self.youtube_spool_path())
+        saved = spool.load_metadata(self.url)
+        if saved is not None:
+            # 前回最後までダウンロードした後に中断した場合は、書き出したページを読み込む。
+            # 分析済みのチャットの結果はページ毎の途中結果から読み込まれる
+            metadata.update(saved)
+            self.on_download_progress(1.0)
+            yield from spool.iter_pages()
+            return
+
+        directory = os.path.dirname(self.save_path)
+        info = {}
+        info_ready = threading.Event()
+        errors = []
+
+        def on_info(res):
+            info.update(res)
+            info_ready.set()
+
+        def download():
+            try:
+                download_chats(self.url, directory, self.yt_dlp_hook, on_info)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                info_ready.set()
+
+        downloader = threading.Thread(target=download, daemon=True)
+        downloader.start()
+        json_path = None
+        try:
+            while not info_ready.wait(0.5):
+                self.check_cancelled()
+            if errors:
+                raise errors[0]
+            metadata.update(youtube_metadata(info, self.url))
+            spool.start(metadata)
+
+            json_path = f"{directory}/{info['id']}.live_chat.json"
+            chunks = follow_chunks(json_path, lambda: not downloader.is_alive(), self.check_cancelled)
+            for lines in iter_line_batches(self.count_download_bytes(chunks)):
+                chats = []
+                seconds = array('q')
+                with self.metrics.stage('parse'):
+                    parse_live_chat_lines(lines, chats, seconds)
+                self.metrics.count('parse', rows=len(chats), bytes=sum(len(line) + 1 for line in lines))
+                if chats:
+                    spool.append(chats, seconds)
+                    if info.get('duration'):
+                        self.on_download_progress(seconds[-1] / info['duration'])
+                    yield chats, seconds
+        finally:
+            # キャンセルした場合も、yt-dlpがファイルを閉じてから削除する
+            downloader.join()
+            if json_path is not None:
+                for path in (json_path, f'{json_path}.part'):
+                    if os.path.exists(path):
+                        os.remove(path)
+        if errors:
+            raise errors[0]
+        spool.finish()
+
+    def youtube_spool_path(self):
+        return f"{self.save_path}{YOUTUBE_SPOOL_SUFFIX}"
+
+    def count_download_bytes(self, chunks):
+        for chunk in chunks:
+            self.metrics.count('download', bytes=len(chunk))
+            yield chunk
+
+    def yt_dlp_hook(self, d):
+        self.check_cancelled()
+        if d['status'] == 'downloading':
+            self.emit_step(f"チャットのダウンロード中: {d['_default_template']}")
+
+    def download_twitch_chats(self, video_id):
+        self.process_step(STEP_LABEL['DOWNLOAD_PREPARE'])
+        columns = ChatColumns()
+        with self.metrics.stage('download'):
+            for page_chats, page_seconds in self.fetch_twitch_pages(video_id):
+                self.process_step(STEP_LABEL['DOWNLOADING'])
+                columns.extend(page_chats, page_seconds)
+        self.metrics.count('download', rows=len(columns))
+
+        metadata = {'url': f"https://www.twitch.tv/videos/{video_id}"}
+        # 区間毎に並行して取得しているため時刻順に並べ直す
+        df = columns.to_df().sort_values('second', kind='stable', ignore_index=True)
+        self.save(metadata, df)
+        # 全てのページを保存できたため、再開用に書き出したページは不要になる
+        remove_spool(self.twitch_spool_dir())
+        return df, metadata
+
+    def download_and_classify(self, page_source):
+        # ダウンロードしたページを別スレッドからキューに入れ、ダウンロードを続けながら感情分析を行う
+        self.process_step(STEP_LABEL['DOWNLOAD_PREPARE'])
+        pages = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+        stopped = threading.Event()
+
+        def put(item):
+            while not stopped.is_set():
+                try:
+                    pages.put(item, timeout=0.5)
+                    return
+                except queue.Full:
+                    pass
+
+        downloaded = [0]
+
+        def produce():
+            try:
+                with closing(page_source):
+                    for page in page_source:
+                        if stopped.is_set():
+                            return
+                        downloaded[0] += len(page[0])
+                        put(page)
+                put(None)
+            except Exception as e:
+                put(e)
+
+        # downloadはダウンロードと感情分析を合わせた時間、classifyはその内の感情分析の時間を記録する
+        download_started = time.perf_counter()
+        producer = threading.Thread(target=produce, daemon=True)
+        producer.start()
+
+        # 推論結果のキャッシュを使わない場合も中断後に再開できるよう、ページ毎の結果を保存先の隣に書き出す。
+        # キャッシュを使う場合はキャッシュにページ毎に書き込まれるため、それを途中結果として使う
+        checkpoint = self.cache
+        if checkpoint is None:
+            checkpoint = EmotionCache(self.page_checkpoint_path(), self.model_name(), EMOTION_CACHE['MAX_ENTRIES'])
+
+        columns = ChatColumns()
+        codes = []
+        scores = []
+        try:
+            finished = False
+            while not finished:
+                page_chats, page_seconds = [], []
+                # キューに溜まっているページを1バッチ分までまとめて分析する
+                while len(page_chats) < self.batch_size:
+                    try:
+                        page = pages.get(timeout=0.5)
+                    except queue.Empty:
+                        self.check_cancelled()
+                        continue
+                    if page is None:
+                        finished = True
+                        break
+                    if isinstance(page, Exception):
+                        raise page
+                    page_chats.extend(page[0])
+                    page_seconds.extend(page[1])
+                    if pages.empty():
+                        break
+
+                if page_chats:
+                    with self.metrics.stage('classify'):
+                        page_codes, page_scores = self.classify_unique_texts(
+                            page_chats, self.batch_size, self.token_size, self.device,
+                            on_batch=self.on_page_batch_finished, cache=checkpoint
+                        )
+                    self.metrics.count('classify', rows=len(page_chats))
+                    codes.append(page_codes)
+                    scores.append(page_scores)
+                    columns.extend(page_chats, page_seconds)
+                    self.emit_overlap_progress(len(columns), downloaded[0])
+                self.process_step(STEP_LABEL['DOWNLOAD_AND_ANALYZE'].format(count=len(columns)))
+        finally:
+            # 通信中の場合もあるためproducerの終了は待たない
+            stopped.set()
+            if checkpoint is not self.cache:
+                checkpoint.close()
+            self.metrics.count('download', seconds=time.perf_counter() - download_started, rows=len(columns))
+
+        df = columns.to_df()
+        n_labels = self.model.config.num_labels
+        add_emotion_columns(
+            df,
+            np.concatenate(codes) if codes else np.zeros(0, dtype=np.uint8),
+            np.concatenate(scores) if scores else np.zeros((0, n_labels), dtype=np.float16),
+            label_names(self.model)
+        )
+        # Twitchは区間毎に並行して取得しているため時刻順に並べ直す
+        return df.sort_values('second', kind='stable', ignore_index=True)
+
+    def fetch_twitch_pages(self, video_id):
+        self.metrics.info['source'] = 'twitch'
+        return fetch_comment_pages(self.twitch_api_url, video_id, self.check_cancelled,
+                                   on_response=self.on_twitch_response, spool_dir=self.twitch_spool_dir(),
+                                   on_progress=self.on_download_progress)
+
+    def twitch_spool_dir(self):
+        return f"{self.save_path}{TWITCH['SPOOL_SUFFIX']}"
+
+    def on_twitch_response(self, response):
+        self.metrics.count('download', requests=1, bytes=len(response.content))
+
+    def emit_step(self, step_name):
+        if self.on_step is not None:
+            self.on_step(step_name)
+
+    def emit_progress(self, value):
+        if self.on_progress is not None:
+            self.on_progress(value)
+
+    def check_cancelled(self):
+        if self.is_cancelled is not None and self.is_cancelled():
+            raise ProcessError(ERROR_MESSAGE['CANCEL'], ErrorCode['CANCEL'])
+
+    def process_step(self, step_name):
+        self.emit_step(step_name)
+        self.check_cancelled()
+
+    def classify_emotions(self, texts, batch_size, token_size, device):
+        self.process_step(STEP_LABEL['EMOTION_ANALYZE_PREPARE'])
+        return self.classify_unique_texts(texts, batch_size, token_size, device, on_batch=self.on_batch_finished,
+                                          make_checkpoint=self.make_checkpoint)
+
+    def classify_unique_texts(self, texts, batch_size, token_size, device, on_batch, make_checkpoint=None,
+                              cache=None):
+        n_labels = self.model.config.num_labels
+        if self.executor is not None:
+            def predict(unique_texts, on_result):
+                # 他のジョブのチャットと合わせて推論される。結果を待つ間もキャンセルを確認する
+                return self.executor.predict(unique_texts, on_result, on_batch, self.check_cancelled)
+        elif self.processes > 1:
+            def predict(unique_texts, on_result):
+                return predict_emotions_parallel(
+                    unique_texts, self.processes, batch_size, token_size, n_labels, backend=self.backend,
+                    dynamic_padding=self.dynamic_padding, on_batch=on_batch, on_result=on_result
+                )
+        else:
+            def predict_batches(remaining_texts, size, on_result):
+                return predict_emotions(
+                    remaining_texts, self.tokenizer, self.model, size, token_size, device,
+                    dynamic_padding=self.dynamic_padding, on_batch=on_batch, on_result=on_result,
+                    metrics=self.metrics
+                )
+
+            def predict(unique_texts, on_result):
+                # メモリ不足の場合はバッチサイズを下げて続行する
+                return predict_with_backoff(unique_texts, predict_batches, batch_size, n_labels, on_result,
+                                            self.on_out_of_memory)
+        return classify_unique(texts, predict, n_labels, self.cache if cache is None else cache, make_checkpoint)
+
+    def page_checkpoint_path(self):
+        return f"{self.save_path}{ANALYSIS_CHECKPOINT['PAGES_SUFFIX']}"
+
+    def make_checkpoint(self, unique_texts):
+        return AnalysisCheckpoint(
+            f"{self.save_path}{ANALYSIS_CHECKPOINT['SUFFIX']}", unique_texts, self.model_name(),
+            self.model.config.num_labels, ANALYSIS_CHECKPOINT['EVERY_BATCHES']
+        )
+
+    def on_batch_finished(self, done, total):
+        self.process_step(STEP_LABEL['EMOTION_ANALYZING'])
+        self.emit_progress(int(done / total * 100))
+
+    def on_page_batch_finished(self, done, total):
+        # ダウンロードと並行している間はページ毎に進捗を更新するため、ここではキャンセルの確認のみ行う
+        self.check_cancelled()
+
+    def on_download_progress(self, fraction):
+        self.download_fraction = min(max(fraction, 0.0), 1.0)
+
+    def emit_overlap_progress(self, classified, downloaded):
+        # 全体の件数は分からないため、ダウンロード済みの件数と動画の長さの内の割合から見積もり、分析済みの割合を進捗とする。
+        # 見積もりが外れても100%にはならないよう、終わるまでは99%までとする
+        if self.download_fraction and downloaded:
+            total = downloaded / self.download_fraction
+            self.emit_progress(min(99, int(classified / total * 100)))
+
+
+def youtube_metadata(info, url):
+    # 配信中の動画にはtimestampが無い場合があるため、配信の開始時刻か現在時刻を使う
+    timestamp = pd.to_datetime(info.get('timestamp') or info.get('release_timestamp') or time.time(), unit='s',
+                               utc=True)
+    return {
+        'title': info['title'],
+        'upload_at': timestamp.tz_convert('Asia/Tokyo').strftime("%Y/%m/%d/%H:%M"),
+        'url': url,
+    }
+
+
+def label_names(model):
+    return [model.config.id2label[i] for i in range(model.config.num_labels)]
+
+
+def score_columns(names):
+    return [f'{SCORE_COLUMN_PREFIX}{name}' for name in names]
+
+
+def stale_rows(df, metadata, fingerprint, names):
+    # 記録されたモデルが異なる場合や感情・スコアの列が無い場合は全ての行を、それ以外は未分析の行のみを分析する
+    columns = ['emotion', *score_columns(names)]
+    if metadata.get(EMOTION_MODEL_KEY) != fingerprint or not set(columns).issubset(df.columns):
+        return np.ones(len(df), dtype=bool)
+    return (~df['emotion'].isin(names) | df[columns[1:]].isna().any(axis=1)).to_numpy()
+
+
+def add_emotion_columns(df, codes, scores, names):
+    # ラベルはEMOTION_NAMESを順に並べたカテゴリ型(1行1バイト)、各感情のスコアはfloat16の列として保持する
+    categories = list(EMOTION_NAMES) + [name for name in names if name not in EMOTION_NAMES]
+    lookup = np.array([categories.index(name) for name in names], dtype=np.int8)
+    df['emotion'] = pd.Categorical.from_codes(lookup[codes], categories=categories)
+    for i, column in enumerate(score_columns(names)):
+        df[column] = scores[:, i]
+
+
+def predict_emotions(texts, tokenizer, model, batch_size, token_size, device, dynamic_padding=True, on_batch=None,
+                     on_result=None, metrics=None):
+    # モデルは他のスレッドと共有している場合があるため、ここではデバイスを移さない。
+    # deviceに置かれたモデル(get_backendで取得したもの)を渡す
+    # 予測結果は元の行の順番に書き戻す
+    codes = np.zeros(len(texts), dtype=np.uint8)
+    scores = np.zeros((len(texts), model.config.num_labels), dtype=np.float16)
+    model.eval()
+    total_batches = count_batches(len(texts), batch_size, dynamic_padding)
+    batches = iter_batches(texts, tokenizer, batch_size, token_size, dynamic_padding)
+    with torch.no_grad():
+        for batch_idx, (indices, batch) in enumerate(batches):
+            if metrics is not None:
+                mask = batch['attention_mask']
+                metrics.count('classify', batches=1, tokens=int(mask.sum()), padded_tokens=mask.numel())
+            batch = {k: v.to(device) for k, v in batch.items()}
+            outputs = model(**batch)
+            # バッチ毎に1回だけデバイスからホストへ転送する
+            probabilities = torch.softmax(outputs.logits.float(), dim=-1).cpu().numpy()
+            indices = np.asarray(indices)
+            codes[indices] = probabilities.argmax(axis=1)
+            scores[indices] = probabilities
+
+            if on_result is not None:
+                on_result(indices, codes[indices], scores[indices])
+            if on_batch is not None:
+                on_batch(batch_idx + 1, total_batches)
+    return codes, scores
@@ -0,0 +1,141 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import plotly
+import plotly.graph_objects as go
+from plotly.offline import get_plotlyjs
+
+from constants import APP_CACHE_DIR, EMOTION_COLORS
+
+
+def emotion_second_counts(seconds, emotions, emotion_names):
+    # 感情と秒の組み合わせ毎の件数を1回のbincountで集計する。集計間隔の変更時はこの行列を再集計する
+    seconds = np.asarray(seconds, dtype=np.int64)
+    codes = pd.Categorical(emotions, categories=emotion_names).codes.astype(np.int64)
+    n_seconds = int(seconds.max()) + 1 if len(seconds) else 0
+    valid = codes >= 0
+    flat = codes[valid] * n_seconds + seconds[valid]
+    return np.bincount(flat, minlength=len(emotion_names) * n_seconds).reshape(len(emotion_names), n_seconds)
+
+
+def emotion_second_scores(seconds, scores, emotion_names):
+    # 各感情のスコアを秒毎に合計する(スコアの期待値による件数)。スコアの無い感情は0とする
+    seconds = np.asarray(seconds, dtype=np.int64)
+    n_seconds = int(seconds.max()) + 1 if len(seconds) else 0
+    matrix = np.zeros((len(emotion_names), n_seconds), dtype=np.float64)
+    for i, name in enumerate(emotion_names):
+        if name in scores:
+            matrix[i] = np.bincount(seconds, weights=np.asarray(scores[name], dtype=np.float64),
+                                    minlength=n_seconds)
+    return matrix
+
+
+def rebin_counts(second_counts, bin_seconds):
+    n_seconds = second_counts.shape[1]
+    if n_seconds == 0:
+        return np.empty(0, dtype=np.int64), second_counts
+    bin_starts = np.arange(0, n_seconds, bin_seconds)
+    return bin_starts, np.add.reduceat(second_counts, bin_starts, axis=1)
+
+
+def build_emotion_figure(second_matrix, emotion_names, bin_width, expected=False):
+    # 生のチャットではなく集計済みの件数を渡すことで、HTMLのサイズを集計区間の数に比例させる
+    bin_starts, counts = rebin_counts(second_matrix, bin_width * 60)
+    max_minutes = max(second_matrix.shape[1] - 1, 0) // 60
+
+    fig = go.Figure()
+    for emotion, emotion_counts in zip(emotion_names, counts):
+        fig.add_trace(go.Bar(
+            x=bin_starts // 60,
+            y=emotion_counts,
+            width=bin_width,
+            offset=0,
+            name=emotion,
+            marker_color=EMOTION_COLORS.get(emotion, 'grey'),
+            marker_line_width=0
+        ))
+
+    update_emotion_layout(fig, expected)
+
+    if bin_width == 1:
+        value = '%{y:.1f}' if expected else '%{y}'
+        fig.update_traces(hovertemplate=f'%{{x}}分 - %{{x}}分59秒<br>{value}')
+        fig.update_xaxes(dtick=5, ticksuffix='分')
+    else:
+        tick_vals = list(range(0, int(max_minutes) + bin_width, bin_width))
+        tick_text = [f'{i}分' for i in tick_vals]
+        fig.update_xaxes(tickvals=tick_vals, ticktext=tick_text, ticksuffix='分59秒')
+    return fig
+
+
+def build_live_figure(emotion_names, bin_seconds):
+    # ライブ表示用の空のグラフ。区間はextend_bins_jsでページを再読み込みせずに追加する
+    fig = go.Figure()
+    for emotion in emotion_names:
+        fig.add_trace(go.Bar(
+            x=[],
+            y=[],
+            width=bin_seconds / 60,
+            offset=0,
+            name=emotion,
+            marker_color=EMOTION_COLORS.get(emotion, 'grey'),
+            marker_line_width=0,
+            hovertemplate='%{x:.1f}分<br>%{y}'
+        ))
+    update_emotion_layout(fig)
+    fig.update_xaxes(ticksuffix='分')
+    return fig
+
+
+def extend_bins_js(div_id, start, bin_seconds, counts, max_bins):
+    # counts(区間 x 感情)をグラフの各感情の棒に追加する。max_binsを超えた古い区間はグラフから消える
+    x = ((start + np.arange(len(counts)) * bin_seconds) / 60).tolist()
+    update = {'x': [x] * counts.shape[1], 'y': counts.T.tolist()}
+    return f"Plotly.extendTraces('{div_id}', {json.dumps(update)}, {list(range(counts.shape[1]))}, {max_bins});"
+
+
+def update_emotion_layout(fig, expected=False):
+    fig.update_layout(
+        barmode='stack',
+        title=None,
+        xaxis_title='時間 (分)',
+        yaxis_title='コメント数(スコアの期待値)' if expected else 'コメント数',
+        bargap=0,
+        # 集計間隔を変更しても凡例の選択や表示範囲を維持する
+        uirevision='emotion-chart',
+        margin=dict(
+            l=50, r=50, t=30, b=50
+        ),
+        legend=dict(
+            font=dict(
+                size=16
+            ),
+            itemclick='toggleothers',
+            itemdoubleclick='toggle'
+        ),
+        xaxis=dict(
+            rangeslider=dict(
+                visible=True
+            ),
+            rangemode='nonnegative',
+        ),
+        yaxis=dict(
+            rangemode='nonnegative',
+        ),
+        modebar=dict(
+            remove=['toImage', 'select', 'lasso']
+        )
+    )
+
+
+def local_plotly_js():
+    # オフライン環境でも表示できるように、plotlyに同梱されているplotly.jsをローカルに書き出して参照する
+    path = APP_CACHE_DIR / f'plotly-{plotly.__version__}.min.js'
+    if not path.exists():
+        os.makedirs(APP_CACHE_DIR, exist_ok=True)
+        tmp_path = path.with_suffix('.tmp')
+        tmp_path.write_text(get_plotlyjs(), encoding='utf-8')
+        os.replace(tmp_path, path)
+    return path
@@ -0,0 +1,84 @@
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def peak_rss_mib():
+    if resource is None:
+        return None
+    # Linuxではキロバイト、macOSではバイト単位
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 ** 2 if sys.platform == 'darwin' else peak / 1024
+
+
+def peak_cuda_mib():
+    torch = sys.modules.get('torch')
+    if torch is None or not torch.cuda.is_available():
+        return None
+    return torch.cuda.max_memory_allocated() / 1024 ** 2
+
+
+class RunMetrics:
+    # 1回の実行の段階毎の時間と件数を集計する。ダウンロードのスレッドからも呼ばれるためロックで保護する
+    def __init__(self, **info):
+        self.info = info
+        self.stages = {}
+        self.lock = threading.Lock()
+        self.started_at = time.time()
+        self.start = time.perf_counter()
+
+    def stage_entry(self, name):
+        return self.stages.setdefault(name, {'seconds': 0.0})
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self.lock:
+                self.stage_entry(name)['seconds'] += elapsed
+
+    def count(self, name, **counters):
+        with self.lock:
+            entry = self.stage_entry(name)
+            for key, value in counters.items():
+                entry[key] = entry.get(key, 0) + value
+
+    def report(self, status='completed'):
+        with self.lock:
+            stages = {name: dict(entry) for name, entry in self.stages.items()}
+        for entry in stages.values():
+            seconds = entry['seconds']
+            for key in ('requests', 'bytes', 'rows', 'tokens', 'batches'):
+                if key in entry and seconds:
+                    entry[f'{key}_per_second'] = entry[key] / seconds
+            if entry.get('padded_tokens'):
+                # パディングに使われたトークンの割合
+                entry['padding_ratio'] = 1 - entry['tokens'] / entry['padded_tokens']
+        return {
+            **self.info,
+            'status': status,
+            'started_at': time.strftime('%Y-%m-%dT%H:%M:%S%z', time.localtime(self.started_at)),
+            'seconds': time.perf_counter() - self.start,
+            'peak_rss_mib': peak_rss_mib(),
+            'peak_cuda_mib': peak_cuda_mib(),
+            'stages': stages,
+        }
+
+    def write(self, path, status='completed'):
+        report = self.report(status)
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as file:
+            json.dump(report, file, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, path)
+        return report
@@ -0,0 +1,182 @@
+import math
+import queue
+import threading
+import time
+
+import numpy as np
+
+from auto_tuning import predict_with_backoff
+from constants import JOB_QUEUE
+from inference_backend import backend_device, get_backend
+from pipeline import predict_emotions
+from run_metrics import RunMetrics
+
+
+class InferenceRequest:
+    # 1つのジョブから依頼された分析。結果は推論スレッドから区間毎にresultsへ入れて返す
+    def __init__(self, texts):
+        self.texts = texts
+        self.next = 0
+        self.cancelled = False
+        self.results = queue.Queue()
+
+    def remaining(self):
+        return len(self.texts) - self.next
+
+
+class SharedInferenceExecutor:
+    # 全てのジョブの感情分析を1つのスレッドで行い、モデルをジョブ間で共有する。
+    # 複数のジョブから依頼されたチャットを合わせて推論するため、ジョブ毎の件数が少なくてもバッチが埋まる
+    def __init__(self, nlp_components, backend, device, batch_size, token_size, dynamic_padding=True,
+                 chunk_batches=JOB_QUEUE['CHUNK_BATCHES'], fill_wait=JOB_QUEUE['FILL_WAIT']):
+        self.nlp_components = nlp_components
+        self.tokenizer = nlp_components['tokenizer']
+        self.backend = backend
+        self.device = backend_device(backend, device)
+        self.batch_size = batch_size
+        self.token_size = token_size
+        self.dynamic_padding = dynamic_padding
+        self.chunk_batches = chunk_batches
+        self.fill_wait = fill_wait
+        self.n_labels = nlp_components['model'].config.num_labels
+        self.metrics = RunMetrics(backend=backend, device=str(self.device), batch_size=batch_size,
+                                  token_size=token_size)
+
+        self.model = None
+        self.error = None
+        self.pending = []
+        self.condition = threading.Condition()
+        self.closed = False
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def predict(self, texts, on_result=None, on_batch=None, check_cancelled=None):
+        # ジョブのスレッドから呼ばれ、全ての結果が揃うまで待つ。on_result・on_batchもジョブのスレッドで呼ぶ
+        codes = np.zeros(len(texts), dtype=np.uint8)
+        scores = np.zeros((len(texts), self.n_labels), dtype=np.float16)
+        if not texts:
+            return codes, scores
+        request = InferenceRequest(texts)
+        with self.condition:
+            if self.error is not None:
+                raise self.error
+            if self.closed:
+                raise RuntimeError('推論スレッドは終了しています')
+            self.pending.append(request)
+            self.condition.notify()
+        done = 0
+        try:
+            while done < len(texts):
+                if check_cancelled is not None:
+                    check_cancelled()
+                try:
+                    result = request.results.get(timeout=0.2)
+                except queue.Empty:
+                    continue
+                if isinstance(result, BaseException):
+                    raise result
+                start, end, chunk_codes, chunk_scores = result
+                codes[start:end] = chunk_codes
+                scores[start:end] = chunk_scores
+                done += end - start
+                if on_result is not None:
+                    on_result(np.arange(start, end), chunk_codes, chunk_scores)
+                if on_batch is not None:
+                    on_batch(done, len(texts))
+            return codes, scores
+        finally:
+            # キャンセルやエラーの場合は、まだ推論していないチャットを推論しない
+            request.cancelled = True
+
+    def close(self, wait=True):
+        # 依頼中のジョブが無くなった後に呼ぶ。推論中のバッチがあれば、それを終えてからスレッドが終了する
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+        if wait:
+            self.thread.join()
+
+    def run(self):
+        try:
+            # onnxへの変換等に時間がかかる場合があるため、モデルの準備もこのスレッドで行う
+            self.model = get_backend(self.nlp_components, self.backend, self.device)
+        except Exception as e:
+            self.fail_all(e)
+            return
+        while True:
+            segments = self.next_segments()
+            if segments is None:
+                return
+            self.predict_segments(segments)
+
+    def fail_all(self, error):
+        with self.condition:
+            self.closed = True
+            self.error = error
+            for request in self.pending:
+                request.results.put(error)
+            self.pending.clear()
+
+    def next_segments(self):
+        chunk_size = self.batch_size * self.chunk_batches
+        with self.condition:
+            while True:
+                self.pending = [request for request in self.pending if not request.cancelled]
+                if self.pending:
+                    break
+                if self.closed:
+                    return None
+                self.condition.wait()
+            # 1バッチに満たない場合は、他のジョブから依頼が来るまで少しだけ待つ
+            deadline = time.monotonic() + self.fill_wait
+            while sum(request.remaining() for request in self.pending) < self.batch_size and not self.closed:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                self.condition.wait(timeout)
+                self.pending = [request for request in self.pending if not request.cancelled]
+
+            # 1つの大きなジョブが他のジョブを待たせないよう、依頼中のジョブに均等に割り当てる
+            segments = []
+            capacity = chunk_size
+            while capacity > 0 and self.pending:
+                share = max(1, math.ceil(capacity / len(self.pending)))
+                for request in list(self.pending):
+                    take = min(share, request.remaining(), capacity)
+                    if take == 0:
+                        continue
+                    segments.append((request, request.next, request.next + take))
+                    request.next += take
+                    capacity -= take
+                    if request.remaining() == 0:
+                        self.pending.remove(request)
+            return segments
+
+    def predict_segments(self, segments):
+        texts = [text for request, start, end in segments for text in request.texts[start:end]]
+
+        def predict_batches(remaining_texts, size, on_result):
+            return predict_emotions(
+                remaining_texts, self.tokenizer, self.model, size, self.token_size, self.device,
+                dynamic_padding=self.dynamic_padding, on_result=on_result, metrics=self.metrics
+            )
+
+        try:
+            with self.metrics.stage('classify'):
+                codes, scores = predict_with_backoff(texts, predict_batches, self.batch_size, self.n_labels,
+                                                     on_backoff=self.on_out_of_memory)
+            self.metrics.count('classify', rows=len(texts))
+        except Exception as e:
+            for request, _, _ in segments:
+                request.results.put(e)
+            return
+        offset = 0
+        for request, start, end in segments:
+            n = end - start
+            request.results.put((start, end, codes[offset:offset + n], scores[offset:offset + n]))
+            offset += n
+
+    def on_out_of_memory(self, batch_size):
+        self.batch_size = batch_size
+        self.metrics.info['batch_size'] = batch_size
+        self.metrics.count('classify', out_of_memory=1)
@@ -0,0 +1,56 @@
+import threading
+from types import MappingProxyType
+
+
+class Store:
+    # 処理結果のデータを保持し、変更された回数(世代)で内容が変わったかを判断できるようにする。
+    # データは他のタブと共有するため読み取り専用として扱い、列の追加等が必要な場合はコピーしてから行う
+    def __init__(self):
+        self._data = None
+        self._generation = 0
+        self._derived = {}
+        self._subscribers = []
+        self._lock = threading.Lock()
+
+    def set_data(self, data):
+        # Workerのスレッドからも呼ばれるため、購読者はスレッドをまたいで安全に呼べるものにする
+        with self._lock:
+            self._data = MappingProxyType(dict(data))
+            self._generation += 1
+            self._derived = {}
+            generation = self._generation
+            subscribers = list(self._subscribers)
+        for callback in subscribers:
+            callback(generation)
+
+    def get_data(self):
+        return self._data
+
+    @property
+    def generation(self):
+        return self._generation
+
+    def snapshot(self):
+        with self._lock:
+            return self._generation, self._data
+
+    def subscribe(self, callback):
+        with self._lock:
+            self._subscribers.append(callback)
+        return lambda: self.unsubscribe(callback)
+
+    def unsubscribe(self, callback):
+        with self._lock:
+            if callback in self._subscribers:
+                self._subscribers.remove(callback)
+
+    def derived(self, generation, key, compute):
+        # データから集計した結果を世代毎に1度だけ計算する。古い世代の結果は保持しない
+        with self._lock:
+            if generation == self._generation and key in self._derived:
+                return self._derived[key]
+        value = compute()
+        with self._lock:
+            if generation == self._generation:
+                self._derived[key] = value
+        return value
@@ -1,15 +1,19 @@
 import os
 
-import torch
 from PySide6.QtCore import Qt, QTime, QTimer
 from PySide6.QtWidgets import (QWidget, QVBoxLayout, QHBoxLayout, QFileDialog,
                                QLineEdit, QCheckBox, QComboBox, QProgressBar, QLabel,
-                               QMessageBox, QTextEdit)
+                               QMessageBox, QTextEdit, QPushButton)
 
-from src.constants import STEP_LABEL, BUTTON_LABEL
+from src.constants import STEP_LABEL, BUTTON_LABEL, INFERENCE_BACKENDS, RUN_REPORT_SUFFIX, AUTO_SIZE_LABEL
 from src.utils import Worker, ModelLoader, ClickableLineEdit, StyledButton
 
 
+def parse_size(text):
+    # 自動の場合はNoneとし、分析するチャットに合わせて決める
+    return None if text == AUTO_SIZE_LABEL else int(text)
+
+
 class Tab1Widget(QWidget):
     def __init__(self, store):
         super().__init__()
@@ -44,12 +48,13 @@ class Tab1Widget(QWidget):
         layout.addLayout(url_layout)
         layout.addSpacing(10)
 
-        cuda_label = 'GPU(CUDA)' if torch.cuda.is_available() else 'CPU'
         cuda_link = QLabel('Nvidia GPU(RTX3060等)搭載PCの方はCUDA Toolkit12.1以上をインストールすることで高速化することが出来ます。→'
                            '''<a href='https://developer.nvidia.com/cuda-12-1-1-download-archive'>CUDA download</a>''')
         cuda_link.setOpenExternalLinks(True)
         layout.addWidget(cuda_link)
-        layout.addWidget(QLabel(f"現在の状態: <b>{cuda_label}</b>モードで実行されます。"))
+        # torchの読み込みはモデルと一緒にバックグラウンドで行うため、ロードが終わってから表示する
+        self.device_label = QLabel('現在の状態: 確認中...')
+        layout.addWidget(self.device_label)
 
         # Checkbox
         self.checkbox_skip_analyze = QCheckBox('感情分析をスキップ(チャットのダウンロードのみ)')
@@ -60,27 +65,65 @@ class Tab1Widget(QWidget):
         self.checkbox_force_cpu = QCheckBox('強制的にCPUモードで実行(非推奨)')
         self.checkbox_force_cpu.setMinimumHeight(40)
         layout.addWidget(self.checkbox_force_cpu)
+
+        self.checkbox_dynamic_padding = QCheckBox('チャットを長さ順に並べてバッチ毎にパディング(高速化)')
+        self.checkbox_dynamic_padding.setChecked(True)
+        self.checkbox_dynamic_padding.setMinimumHeight(40)
+        layout.addWidget(self.checkbox_dynamic_padding)
+
+        self.checkbox_use_cache = QCheckBox('推論結果をキャッシュし、過去に分析したチャットの結果を再利用する')
+        self.checkbox_use_cache.setChecked(True)
+        self.checkbox_use_cache.setMinimumHeight(40)
+        layout.addWidget(self.checkbox_use_cache)
+
+        self.checkbox_incremental = QCheckBox('分析済みのファイルは、未分析の行や古いモデルで分析した行のみを分析する')
+        self.checkbox_incremental.setChecked(True)
+        self.checkbox_incremental.setMinimumHeight(40)
+        layout.addWidget(self.checkbox_incremental)
         layout.addSpacing(10)
 
         # Dropdown
         self.batch_size = QComboBox()
         self.batch_size.setMinimumHeight(40)
-        self.batch_size.addItems(['1', '4', '16', '32', '64', '128', '256', '512'])
-        self.batch_size.setCurrentIndex(2)
-        self.batch_size_label = QLabel('バッチサイズ: デフォルト推奨。メモリ不足の場合は小さい数値にする。')
+        self.batch_size.addItems([AUTO_SIZE_LABEL, '1', '4', '16', '32', '64', '128', '256', '512'])
+        self.batch_size.setCurrentIndex(3)
+        self.batch_size_label = QLabel(
+            'バッチサイズ: デフォルト推奨。自動の場合は速度を計測して決めます。メモリ不足の場合は自動で小さくして続行します。'
+        )
         layout.addWidget(self.batch_size_label)
         layout.addWidget(self.batch_size)
         layout.addSpacing(10)
 
         self.token_size = QComboBox()
         self.token_size.setMinimumHeight(40)
-        self.token_size.addItems(['16', '32', '64', '128', '256', '512'])
-        self.token_size.setCurrentIndex(2)
+        self.token_size.addItems([AUTO_SIZE_LABEL, '16', '32', '64', '128', '256', '512'])
+        self.token_size.setCurrentIndex(3)
         self.token_size_label = QLabel(
-            '読み込む文章の最大長(トークン数): デフォルト推奨。メモリ不足、高速化したい場合は小さい数値にする。'
+            '読み込む文章の最大長(トークン数): デフォルト推奨。高速化したい場合は小さい数値にする。'
+            '自動の場合はチャットの99%が収まる長さにします。'
         )
         layout.addWidget(self.token_size_label)
         layout.addWidget(self.token_size)
+        layout.addSpacing(10)
+
+        self.backend = QComboBox()
+        self.backend.setMinimumHeight(40)
+        self.backend.addItems(INFERENCE_BACKENDS)
+        self.backend_label = QLabel(
+            '推論エンジン: torch-int8、onnxはCPUで高速に動作しますが、結果がわずかに異なる場合があります。'
+        )
+        layout.addWidget(self.backend_label)
+        layout.addWidget(self.backend)
+        layout.addSpacing(10)
+
+        self.processes = QComboBox()
+        self.processes.setMinimumHeight(40)
+        self.processes.addItems(['1', '2', '4', '8', '16'])
+        self.processes_label = QLabel(
+            'CPUモードで推論に使うプロセス数: コア数の多いPCでは増やすと高速化します。プロセス毎にモデルを読み込みます。'
+        )
+        layout.addWidget(self.processes_label)
+        layout.addWidget(self.processes)
 
         layout.addSpacing(10)
 
@@ -110,6 +153,18 @@ class Tab1Widget(QWidget):
         self.error_display.setMinimumHeight(100)
         self.error_display.setVisible(False)
         layout.addWidget(self.error_display)
+
+        # 段階毎の時間やスループット。実行が終わると表示できるようになる
+        self.metrics_button = QPushButton('実行の詳細を表示')
+        self.metrics_button.setCheckable(True)
+        self.metrics_button.setVisible(False)
+        self.metrics_button.toggled.connect(self.toggle_metrics)
+        layout.addWidget(self.metrics_button, alignment=Qt.AlignmentFlag.AlignLeft)
+        self.metrics_display = QTextEdit()
+        self.metrics_display.setReadOnly(True)
+        self.metrics_display.setMinimumHeight(150)
+        self.metrics_display.setVisible(False)
+        layout.addWidget(self.metrics_display)
         layout.addStretch()
 
         # init worker
@@ -128,7 +183,8 @@ class Tab1Widget(QWidget):
         self.store = store
 
     def get_save_file(self):
-        save_file, _ = QFileDialog.getSaveFileName(self, '名前をつけてチャットを保存', filter='csv(*.csv)')
+        save_file, _ = QFileDialog.getSaveFileName(self, '名前をつけてチャットを保存',
+                                                   filter='Parquet(*.parquet);;csv(*.csv)')
         if save_file:
             self.save_file_input.setText(save_file)
 
@@ -156,20 +212,28 @@ class Tab1Widget(QWidget):
         self.progress_bar.setValue(0)
         self.error_display.clear()
         self.error_display.setVisible(False)
+        self.metrics_button.setChecked(False)
+        self.metrics_button.setVisible(False)
 
         self.worker = Worker(
             self.save_file_input.text(),
             self.url_input.text(),
             self.checkbox_skip_analyze.isChecked(),
             self.checkbox_force_cpu.isChecked(),
-            int(self.batch_size.currentText()),
-            int(self.token_size.currentText()),
+            parse_size(self.batch_size.currentText()),
+            parse_size(self.token_size.currentText()),
             self.nlp_components,
-            self.store
+            self.store,
+            self.checkbox_dynamic_padding.isChecked(),
+            self.checkbox_use_cache.isChecked(),
+            self.backend.currentText(),
+            int(self.processes.currentText()),
+            self.checkbox_incremental.isChecked()
         )
         self.worker.step_name.connect(self.update_step_name)
         self.worker.progress.connect(self.update_progress)
         self.worker.error.connect(self.display_error)
+        self.worker.metrics.connect(self.display_metrics)
         self.worker.finished.connect(self.process_finished)
         self.timer_reset()
         self.worker.start()
@@ -194,11 +258,42 @@ class Tab1Widget(QWidget):
         self.error_display.append(error_msg)
         self.process_finished()
 
+    def display_metrics(self, report):
+        lines = [
+            f"状態: {report['status']}  合計: {report['seconds']:.1f}秒  "
+            f"デバイス: {report['device']}  推論エンジン: {report['backend']}"
+        ]
+        if report['peak_rss_mib'] is not None:
+            lines.append(f"最大メモリ使用量: {report['peak_rss_mib']:.0f} MiB")
+        if report['peak_cuda_mib'] is not None:
+            lines.append(f"最大GPUメモリ使用量: {report['peak_cuda_mib']:.0f} MiB")
+        units = (('rows', '件'), ('requests', 'リクエスト'), ('bytes', 'バイト'), ('tokens', 'トークン'),
+                 ('batches', 'バッチ'))
+        for stage, entry in report['stages'].items():
+            values = [f"{entry['seconds']:.2f}秒"]
+            for key, unit in units:
+                if key in entry:
+                    rate = entry.get(f'{key}_per_second')
+                    values.append(f"{entry[key]:,}{unit}" + (f" ({rate:,.1f}{unit}/秒)" if rate else ''))
+            if 'padding_ratio' in entry:
+                values.append(f"パディング率 {entry['padding_ratio']:.1%}")
+            lines.append(f"{stage}: " + '  '.join(values))
+        lines.append(f"詳細: {report['save_path']}{RUN_REPORT_SUFFIX}")
+        self.metrics_display.setPlainText('\n'.join(lines))
+        self.metrics_button.setVisible(True)
+
+    def toggle_metrics(self, checked):
+        self.metrics_display.setVisible(checked)
+        self.metrics_button.setText('実行の詳細を隠す' if checked else '実行の詳細を表示')
+
     def process_finished(self):
         self.is_processing = False
         self.start_cancel_button.setText(BUTTON_LABEL['START'])
         self.start_cancel_button.setEnabled(True)
-        torch.cuda.empty_cache()
+        if self.nlp_components is not None:
+            import torch
+
+            torch.cuda.empty_cache()
         self.timer.stop()
         if self.progress_bar.value() == 100:
             QMessageBox.information(self, 'Success', '処理が終わりました！')
@@ -209,7 +304,11 @@ class Tab1Widget(QWidget):
         self.start_cancel_button.setEnabled(False)
 
     def on_model_loaded(self, nlp_components):
+        import torch
+
         self.nlp_components = nlp_components
+        cuda_label = 'GPU(CUDA)' if torch.cuda.is_available() else 'CPU'
+        self.device_label.setText(f"現在の状態: <b>{cuda_label}</b>モードで実行されます。")
         self.step_label.setText(STEP_LABEL['MODEL_LOADED'])
         self.start_cancel_button.setEnabled(True)
         self.start_cancel_button.setText(BUTTON_LABEL['START'])
@@ -230,3 +329,10 @@ class Tab1Widget(QWidget):
         self.batch_size_label.setVisible(is_visible)
         self.batch_size.setVisible(is_visible)
         self.checkbox_force_cpu.setVisible(is_visible)
+        self.checkbox_dynamic_padding.setVisible(is_visible)
+        self.checkbox_use_cache.setVisible(is_visible)
+        self.checkbox_incremental.setVisible(is_visible)
+        self.backend_label.setVisible(is_visible)
+        self.backend.setVisible(is_visible)
+        self.processes_label.setVisible(is_visible)
+        self.processes.setVisible(is_visible)
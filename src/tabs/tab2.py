@@ -1,23 +1,25 @@
 import os
 
-import pandas as pd
-import plotly.graph_objects as go
-from PySide6.QtCore import Qt
+from PySide6.QtCore import Qt, QUrl, Signal
 from PySide6.QtGui import QDragEnterEvent, QDropEvent
-from PySide6.QtWebEngineWidgets import QWebEngineView
-from PySide6.QtWidgets import (QWidget, QVBoxLayout, QHBoxLayout, QFileDialog, QProgressDialog,
-                               QLabel, QMessageBox, QSizePolicy, QSpinBox, QTextBrowser, QPushButton)
+from PySide6.QtWidgets import (QWidget, QVBoxLayout, QHBoxLayout, QFileDialog, QProgressDialog, QComboBox, QLineEdit,
+                               QLabel, QMessageBox, QSizePolicy, QSpinBox, QTextBrowser, QPushButton, QCheckBox)
 
-from src.constants import EMOTION_COLORS
-from src.utils import read_csv_with_metadata, ClickableLabel, ClickableLineEdit, SavePlotThread
+from src.constants import EMOTION_COLORS, ERROR_MESSAGE, LIVE, SCORE_COLUMN_PREFIX
+from src.utils import ClickableLabel, ClickableLineEdit, LiveWorker, SavePlotThread
+
+PLOT_DIV_ID = 'emotion-chart'
 
 
 class Tab2Widget(QWidget):
+    # Storeの購読者はWorkerのスレッドから呼ばれるため、シグナルでGUIのスレッドに渡す
+    store_changed = Signal(int)
+
     def __init__(self, store):
         super().__init__()
         layout = QVBoxLayout(self)
 
-        self.drag_drop_area = ClickableLabel('ドラッグ＆ドロップするか、クリックしてcsvファイルを選択してください')
+        self.drag_drop_area = ClickableLabel('ドラッグ＆ドロップするか、クリックしてparquetかcsvファイルを選択してください')
         self.drag_drop_area.setAlignment(Qt.AlignmentFlag.AlignCenter)
         self.drag_drop_area.setFixedHeight(80)
         self.drag_drop_area.clicked.connect(self.select_csv)
@@ -27,10 +29,48 @@ class Tab2Widget(QWidget):
         csv_layout = QHBoxLayout()
         self.csv_input = ClickableLineEdit(self.select_csv)
         self.csv_input.setMinimumHeight(40)
-        csv_layout.addWidget(QLabel('CSV File:'))
+        csv_layout.addWidget(QLabel('File:'))
         csv_layout.addWidget(self.csv_input, 1)
         layout.addLayout(csv_layout)
 
+        # 配信中のチャットを受信しながらグラフに区間を追加していく。保存済みのファイルを指定するとリプレイする
+        live_layout = QHBoxLayout()
+        self.live_input = QLineEdit()
+        self.live_input.setMinimumHeight(40)
+        self.live_input.setPlaceholderText('配信中のYoutube・TwitchのURL、またはリプレイするファイル')
+        live_layout.addWidget(QLabel('Live:'))
+        live_layout.addWidget(self.live_input, 1)
+        self.live_speed = QComboBox()
+        self.live_speed.addItems(['1', '2', '5', '10', '60'])
+        self.live_speed.setToolTip('リプレイの再生速度(倍)')
+        live_layout.addWidget(self.live_speed)
+        self.live_button = QPushButton('ライブ表示を開始')
+        self.live_button.setEnabled(False)
+        self.live_button.clicked.connect(self.toggle_live)
+        live_layout.addWidget(self.live_button)
+        layout.addLayout(live_layout)
+        # ライブ表示は受信したチャットを少しずつ推論するため、バッチサイズ等は自動で決めずに指定する
+        self.live_settings = QWidget()
+        live_settings_layout = QHBoxLayout(self.live_settings)
+        live_settings_layout.setContentsMargins(0, 0, 0, 0)
+        self.live_batch_size = QComboBox()
+        self.live_batch_size.addItems(['1', '4', '16', '32', '64', '128', '256', '512'])
+        self.live_batch_size.setCurrentText('16')
+        live_settings_layout.addWidget(QLabel('バッチサイズ:'))
+        live_settings_layout.addWidget(self.live_batch_size)
+        self.live_token_size = QComboBox()
+        self.live_token_size.addItems(['16', '32', '64', '128', '256', '512'])
+        self.live_token_size.setCurrentText('64')
+        live_settings_layout.addWidget(QLabel('トークン数:'))
+        live_settings_layout.addWidget(self.live_token_size)
+        self.live_force_cpu = QCheckBox('強制的にCPUモードで実行')
+        live_settings_layout.addWidget(self.live_force_cpu)
+        live_settings_layout.addStretch(1)
+        layout.addWidget(self.live_settings)
+        self.live_summary = QLabel()
+        self.live_summary.setVisible(False)
+        layout.addWidget(self.live_summary)
+
         # Metadata display
         self.metadata_browser = QTextBrowser()
         self.metadata_browser.setMaximumHeight(95)
@@ -47,6 +87,11 @@ class Tab2Widget(QWidget):
         self.bin_spinbox.valueChanged.connect(self.update_plot)
         bin_width_layout.addWidget(QLabel('集計間隔:'))
         bin_width_layout.addWidget(self.bin_spinbox)
+
+        # 最も高いスコアの感情の件数ではなく、各感情のスコアの合計(期待値)で集計する
+        self.checkbox_expected = QCheckBox('スコアの期待値で集計')
+        self.checkbox_expected.checkStateChanged.connect(self.update_plot)
+        bin_width_layout.addWidget(self.checkbox_expected)
         bin_width_layout.addStretch(1)
 
         # グラフ保存ボタンを追加
@@ -56,17 +101,33 @@ class Tab2Widget(QWidget):
         layout.addLayout(bin_width_layout)
 
         # Plot area
-        self.plot_widget = QWebEngineView()
+        # QtWebEngineの初期化は重いため、最初にグラフを表示する時に作成する
+        self.plot_widget = None
+        self.plot_container = QWidget()
+        self.plot_container.setSizePolicy(QSizePolicy.Policy.Expanding, QSizePolicy.Policy.Expanding)
+        self.plot_layout = QVBoxLayout(self.plot_container)
+        self.plot_layout.setContentsMargins(0, 0, 0, 0)
         self.setMinimumHeight(700)
-        self.plot_widget.setSizePolicy(QSizePolicy.Policy.Expanding, QSizePolicy.Policy.Expanding)
-        self.plot_widget.setHtml('')
-        layout.addWidget(self.plot_widget, 1)
+        layout.addWidget(self.plot_container, 1)
 
         self.store = store
         self.df = None  # Store the DataFrame
         self.metadata = None
+        # 表示しているStoreのデータの世代。タブを切り替えた時はこの値の比較のみで更新が必要か判断する
+        self.generation = None
         self.fig = None
         self.save_thread = None
+        self.plot_loaded = False
+        self.store_changed.connect(self.on_store_changed, Qt.ConnectionType.QueuedConnection)
+        self.store.subscribe(self.store_changed.emit)
+        self.nlp_components = None
+        self.live_worker = None
+        # ライブ表示中かどうか。停止後に保存したファイルを表示する前に戻す
+        self.live_active = False
+        # 停止した時に保存したファイル。ライブ表示が終わってから表示する
+        self.live_saved_path = None
+        # グラフの読み込みが終わる前に届いた区間
+        self.pending_bins_js = []
 
         # Enable drag and drop
         self.setAcceptDrops(True)
@@ -78,102 +139,206 @@ class Tab2Widget(QWidget):
     def dropEvent(self, event: QDropEvent):
         files = [u.toLocalFile() for u in event.mimeData().urls()]
         for file_path in files:
-            if file_path.lower().endswith('.csv'):
+            if file_path.lower().endswith(('.csv', '.parquet')):
                 self.csv_input.setText(file_path)
                 self.load_and_plot_csv(file_path)
 
     def select_csv(self):
-        file_name, _ = QFileDialog.getOpenFileName(self, 'Select CSV File', '', 'CSV Files (*.csv)')
+        file_name, _ = QFileDialog.getOpenFileName(self, 'Select File', '', 'Chat Files (*.parquet *.csv)')
         if file_name:
             self.csv_input.setText(file_name)
             self.load_and_plot_csv(file_name)
 
     def load_and_plot_csv(self, file_name):
+        from src.archive import read_dataset
+
         try:
-            self.df, self.metadata = read_csv_with_metadata(file_name)
-            self.df['second'] = pd.to_numeric(self.df['second'])
-            self.update_plot()
-            self.update_metadata_display()
+            # グラフの表示にはチャット本文は不要なため読み込まない
+            df, metadata = read_dataset(
+                file_name,
+                columns=lambda column: column in ('second', 'emotion') or column.startswith(SCORE_COLUMN_PREFIX)
+            )
+            # 読み込んだファイルもStoreを通して表示し、集計結果をStoreに保持する
+            self.store.set_data({'df': df, 'metadata': metadata, 'source': file_name})
+            self.update_plot_from_store()
         except Exception as e:
-            QMessageBox.critical(self, 'Error', f"Error loading or plotting CSV: {e}")
+            QMessageBox.critical(self, 'Error', f"Error loading or plotting file: {e}")
 
     def update_plot(self):
         bin_width = self.bin_spinbox.value()
         if self.df is None:
             return
 
-        max_minutes = self.df['minute'].max()
-
-        fig = go.Figure()
-        if 'emotion' not in self.df.columns:
-            self.df['emotion'] = '未分類'
-        for emotion in reversed(EMOTION_COLORS.keys()):
-            emotion_data = self.df[self.df['emotion'] == emotion]
-            fig.add_trace(go.Histogram(
-                x=emotion_data['minute'],
-                name=emotion,
-                marker_color=EMOTION_COLORS.get(emotion, 'grey'),
-                xbins=dict(start=0, end=max_minutes, size=bin_width),
-                autobinx=False
-            ))
-
-        fig.update_layout(
-            barmode='stack',
-            title=None,
-            xaxis_title='時間 (分)',
-            yaxis_title='コメント数',
-            margin=dict(
-                l=50, r=50, t=30, b=50
-            ),
-            legend=dict(
-                font=dict(
-                    size=16
-                ),
-                itemclick='toggleothers',
-                itemdoubleclick='toggle'
-            ),
-            xaxis=dict(
-                rangeslider=dict(
-                    visible=True
-                ),
-                rangemode='nonnegative',
-            ),
-            yaxis=dict(
-                rangemode='nonnegative',
-            ),
-            modebar=dict(
-                remove=['toImage', 'select', 'lasso']
-            )
-        )
+        import numpy as np
+        import pandas as pd
+        from src.plot_data import build_emotion_figure, emotion_second_counts, emotion_second_scores, local_plotly_js
+
+        emotion_names = list(reversed(EMOTION_COLORS.keys()))
+        score_columns = {
+            column[len(SCORE_COLUMN_PREFIX):]: self.df[column]
+            for column in self.df.columns if column.startswith(SCORE_COLUMN_PREFIX)
+        }
+        expected = self.checkbox_expected.isChecked() and bool(score_columns)
+
+        def compute_matrix():
+            if expected:
+                return emotion_second_scores(self.df['second'], score_columns, emotion_names)
+            if 'emotion' in self.df.columns:
+                emotions = self.df['emotion']
+            else:
+                # Storeのデータは共有しているため列を追加せず、全て未分類として集計する
+                emotions = pd.Categorical.from_codes(np.full(len(self.df), emotion_names.index('未分類')),
+                                                     categories=emotion_names)
+            return emotion_second_counts(self.df['second'], emotions, emotion_names)
 
-        if bin_width == 1:
-            fig.update_traces(hovertemplate='%{x} - %{x}59秒<br>%{y}')
-            fig.update_xaxes(dtick=5, ticksuffix='分')
+        # 集計方法毎の感情 x 秒の件数行列。データが変わるまで使い回し、集計間隔の変更時は再集計のみ行う
+        second_matrix = self.store.derived(self.generation, ('second_matrix', expected), compute_matrix)
+
+        fig = build_emotion_figure(second_matrix, emotion_names, bin_width, expected)
+        self.ensure_plot_widget()
+        if self.plot_loaded:
+            # 表示済みのグラフにはデータのみを送り、ページの再読み込みを行わない
+            self.plot_widget.page().runJavaScript(f"Plotly.react('{PLOT_DIV_ID}', {fig.to_json()});")
         else:
-            tick_vals = list(range(0, int(max_minutes) + bin_width, bin_width))
-            tick_text = [f'{i}分' for i in tick_vals]
-            fig.update_xaxes(tickvals=tick_vals, ticktext=tick_text, ticksuffix='分59秒')
-        html = fig.to_html(include_plotlyjs='cdn')
-        self.plot_widget.setHtml(html)
+            plotly_js = local_plotly_js()
+            html = fig.to_html(include_plotlyjs=plotly_js.name, div_id=PLOT_DIV_ID)
+            self.plot_widget.setHtml(html, QUrl.fromLocalFile(f'{plotly_js.parent}/'))
         self.fig = fig
 
-    def update_plot_from_store(self):
-        data = self.store.get_data()
-        if data is None:
-            return
+    def ensure_plot_widget(self):
+        if self.plot_widget is None:
+            from PySide6.QtWebEngineWidgets import QWebEngineView
+
+            self.plot_widget = QWebEngineView()
+            self.plot_widget.setSizePolicy(QSizePolicy.Policy.Expanding, QSizePolicy.Policy.Expanding)
+            self.plot_widget.loadFinished.connect(self.on_plot_loaded)
+            self.plot_layout.addWidget(self.plot_widget)
+
+    def reset_plot_data(self):
+        self.plot_loaded = False
 
-        df = data.get('df')
-        if df is None:
+    def on_plot_loaded(self, ok):
+        self.plot_loaded = ok and self.fig is not None
+        if self.plot_loaded:
+            for js in self.pending_bins_js:
+                self.plot_widget.page().runJavaScript(js)
+            self.pending_bins_js = []
+
+    def on_model_loaded(self, nlp_components):
+        self.nlp_components = nlp_components
+        self.live_button.setEnabled(True)
+
+    def live_running(self):
+        return self.live_active
+
+    def toggle_live(self):
+        if self.live_running():
+            self.live_worker.requestInterruption()
+            self.live_button.setText('停止中...')
+            self.live_button.setEnabled(False)
+        else:
+            self.start_live()
+
+    def start_live(self):
+        source = self.live_input.text().strip()
+        if not source:
+            QMessageBox.warning(self, 'エラー', 'URLかファイルを入力してください。')
+            return
+        save_path, _ = QFileDialog.getSaveFileName(self, '受信したチャットの保存先', filter='Parquet(*.parquet);;csv(*.csv)')
+        if not save_path:
             return
+        from src.plot_data import build_live_figure, local_plotly_js
+
+        self.df = None
+        self.metadata = None
+        # 停止した後にタブを切り替えた場合は、Storeのデータを表示し直す
+        self.generation = None
+        self.reset_plot_data()
+        self.pending_bins_js = []
+        self.fig = build_live_figure(list(reversed(EMOTION_COLORS.keys())), LIVE['BIN_SECONDS'])
+        self.ensure_plot_widget()
+        plotly_js = local_plotly_js()
+        self.plot_widget.setHtml(self.fig.to_html(include_plotlyjs=plotly_js.name, div_id=PLOT_DIV_ID),
+                                 QUrl.fromLocalFile(f'{plotly_js.parent}/'))
+        self.metadata_browser.setVisible(False)
+        self.csv_input.setText('ライブ表示中')
+
+        self.live_saved_path = None
+        self.live_worker = LiveWorker(save_path, source, self.live_force_cpu.isChecked(),
+                                      int(self.live_batch_size.currentText()), int(self.live_token_size.currentText()),
+                                      self.nlp_components, speed=float(self.live_speed.currentText()))
+        self.live_worker.step_name.connect(self.live_summary.setText)
+        self.live_worker.bins.connect(self.on_live_bins)
+        self.live_worker.error.connect(self.on_live_error)
+        self.live_worker.saved.connect(self.on_live_saved)
+        self.live_worker.finished.connect(self.on_live_finished)
+        self.live_summary.setVisible(True)
+        self.live_button.setText('ライブ表示を停止')
+        self.live_settings.setEnabled(False)
+        self.live_active = True
+        self.live_worker.start()
+
+    def on_live_bins(self, update):
+        import numpy as np
+        from src.plot_data import extend_bins_js
+
+        # モデルのラベルの順番をグラフの感情の順番に並べ替える
+        emotion_names = list(reversed(EMOTION_COLORS.keys()))
+        counts = np.zeros((len(update['counts']), len(emotion_names)), dtype=np.int64)
+        for i, name in enumerate(emotion_names):
+            if name in update['names']:
+                counts[:, i] = update['counts'][:, update['names'].index(name)]
+        js = extend_bins_js(PLOT_DIV_ID, update['start'], update['bin_seconds'], counts,
+                            LIVE['WINDOW_SECONDS'] // update['bin_seconds'])
+        if self.plot_loaded:
+            self.plot_widget.page().runJavaScript(js)
+        else:
+            self.pending_bins_js.append(js)
 
-        if self.df is not None and self.df.equals(df):
+        recent = update['recent']
+        total = int(recent.sum())
+        if total:
+            shares = sorted(zip(update['names'], recent), key=lambda item: -item[1])[:3]
+            self.live_summary.setText(f"直近{LIVE['SUMMARY_SECONDS']}秒 ({total}件): " +
+                                      '  '.join(f'{name} {count / total:.0%}' for name, count in shares))
+
+    def on_live_error(self, error_msg):
+        if error_msg != ERROR_MESSAGE['CANCEL']:
+            QMessageBox.critical(self, 'Error', error_msg)
+
+    def on_live_saved(self, save_path):
+        # savedはWorkerのスレッドの実行中に届くため、ここでは保存先のみ記録する
+        self.live_saved_path = save_path
+
+    def on_live_finished(self):
+        self.live_active = False
+        self.live_button.setText('ライブ表示を開始')
+        self.live_button.setEnabled(True)
+        self.live_settings.setEnabled(True)
+        # 停止した後は、保存したファイルを通常のグラフとして表示する
+        if self.live_saved_path is not None:
+            self.csv_input.setText(self.live_saved_path)
+            self.load_and_plot_csv(self.live_saved_path)
+
+    def on_store_changed(self, generation):
+        # 表示中の場合のみすぐに更新し、それ以外はタブを切り替えた時に更新する
+        if self.isVisible():
+            self.update_plot_from_store()
+
+    def update_plot_from_store(self):
+        generation, data = self.store.snapshot()
+        if data is None or data.get('df') is None:
+            return
+        if generation == self.generation or self.live_running():
             return
 
-        self.df = df
+        self.df = data['df']
         self.metadata = data.get('metadata')
+        self.generation = generation
+        self.reset_plot_data()
         self.update_plot()
         self.update_metadata_display()
-        self.csv_input.setText('ダウンロードタブで処理が完了した内容を表示しています')
+        self.csv_input.setText(data.get('source') or 'ダウンロードタブで処理が完了した内容を表示しています')
 
     def update_metadata_display(self):
         if self.metadata:
@@ -210,6 +375,9 @@ class Tab2Widget(QWidget):
         if self.fig is None:
             QMessageBox.warning(self, '警告', 'グラフが作成されていません。')
             return
+        if self.live_running():
+            QMessageBox.warning(self, '警告', 'ライブ表示を停止してから保存してください。')
+            return
         read_file_path = self.csv_input.text()
         file_name = os.path.splitext(read_file_path)[0]
         file_name, _ = QFileDialog.getSaveFileName(self, 'グラフを保存', file_name, 'PNG Files (*.png)')
@@ -0,0 +1,262 @@
+import os
+
+from PySide6.QtCore import Qt
+from PySide6.QtWidgets import (QWidget, QVBoxLayout, QHBoxLayout, QFileDialog, QCheckBox, QComboBox, QProgressBar,
+                               QLabel, QMessageBox, QPlainTextEdit, QPushButton, QTableWidget, QTableWidgetItem,
+                               QHeaderView, QAbstractItemView)
+
+from src.constants import INFERENCE_BACKENDS, JOB_QUEUE, JOB_STATUS, ERROR_MESSAGE
+from src.utils import Worker, ClickableLineEdit
+
+SOURCE_COLUMN, STATUS_COLUMN, PROGRESS_COLUMN, CANCEL_COLUMN = range(4)
+
+
+class Tab3Widget(QWidget):
+    # 複数のURL・ファイルをキューに入れ、同時に実行する数を制限しながら順に処理する。
+    # 感情分析は全てのジョブで1つの推論スレッドを共有し、ジョブをまたいでバッチを埋める
+    def __init__(self):
+        super().__init__()
+        layout = QVBoxLayout(self)
+
+        self.sources_input = QPlainTextEdit()
+        self.sources_input.setPlaceholderText('YoutubeかTwitchのURL、またはparquetかcsvファイルのパスを1行に1つずつ入力')
+        self.sources_input.setMaximumHeight(150)
+        layout.addWidget(self.sources_input)
+
+        add_files_button = QPushButton('ファイルを追加')
+        add_files_button.clicked.connect(self.select_files)
+        layout.addWidget(add_files_button, alignment=Qt.AlignmentFlag.AlignLeft)
+
+        dir_layout = QHBoxLayout()
+        self.out_dir_input = ClickableLineEdit(self.select_out_dir)
+        self.out_dir_input.setMinimumHeight(40)
+        self.out_dir_input.setPlaceholderText('結果を保存するディレクトリ')
+        dir_layout.addWidget(QLabel('保存先:'))
+        dir_layout.addWidget(self.out_dir_input, 1)
+        self.file_format = QComboBox()
+        self.file_format.addItems(['parquet', 'csv'])
+        dir_layout.addWidget(self.file_format)
+        layout.addLayout(dir_layout)
+
+        # キューに入れたジョブは同じ推論スレッドを使うため、実行中は推論の設定を変更できないようにする
+        self.settings = QWidget()
+        settings_layout = QHBoxLayout(self.settings)
+        settings_layout.setContentsMargins(0, 0, 0, 0)
+        self.max_jobs = QComboBox()
+        self.max_jobs.addItems(['1', '2', '3', '4', '6', '8'])
+        self.max_jobs.setCurrentText(str(JOB_QUEUE['MAX_DOWNLOADS']))
+        settings_layout.addWidget(QLabel('同時実行数:'))
+        settings_layout.addWidget(self.max_jobs)
+        self.batch_size = QComboBox()
+        self.batch_size.addItems(['1', '4', '16', '32', '64', '128', '256', '512'])
+        self.batch_size.setCurrentText('16')
+        settings_layout.addWidget(QLabel('バッチサイズ:'))
+        settings_layout.addWidget(self.batch_size)
+        self.token_size = QComboBox()
+        self.token_size.addItems(['16', '32', '64', '128', '256', '512'])
+        self.token_size.setCurrentText('64')
+        settings_layout.addWidget(QLabel('トークン数:'))
+        settings_layout.addWidget(self.token_size)
+        self.backend = QComboBox()
+        self.backend.addItems(INFERENCE_BACKENDS)
+        settings_layout.addWidget(QLabel('推論エンジン:'))
+        settings_layout.addWidget(self.backend)
+        self.checkbox_force_cpu = QCheckBox('強制的にCPUモードで実行')
+        settings_layout.addWidget(self.checkbox_force_cpu)
+        settings_layout.addStretch(1)
+        layout.addWidget(self.settings)
+
+        checkbox_layout = QHBoxLayout()
+        self.checkbox_skip_analyze = QCheckBox('感情分析をスキップ')
+        self.checkbox_use_cache = QCheckBox('推論結果のキャッシュを使用')
+        self.checkbox_use_cache.setChecked(True)
+        for checkbox in (self.checkbox_skip_analyze, self.checkbox_use_cache):
+            checkbox_layout.addWidget(checkbox)
+        checkbox_layout.addStretch(1)
+        layout.addLayout(checkbox_layout)
+
+        button_layout = QHBoxLayout()
+        self.add_button = QPushButton('キューに追加して開始')
+        self.add_button.setEnabled(False)
+        self.add_button.clicked.connect(self.add_jobs)
+        button_layout.addWidget(self.add_button)
+        cancel_all_button = QPushButton('全てキャンセル')
+        cancel_all_button.clicked.connect(self.cancel_all)
+        button_layout.addWidget(cancel_all_button)
+        clear_button = QPushButton('終了したジョブを消去')
+        clear_button.clicked.connect(self.clear_finished)
+        button_layout.addWidget(clear_button)
+        button_layout.addStretch(1)
+        layout.addLayout(button_layout)
+
+        self.job_table = QTableWidget(0, 4)
+        self.job_table.setHorizontalHeaderLabels(['入力', '状態', '進捗', ''])
+        self.job_table.horizontalHeader().setSectionResizeMode(SOURCE_COLUMN, QHeaderView.ResizeMode.Stretch)
+        self.job_table.horizontalHeader().setSectionResizeMode(STATUS_COLUMN, QHeaderView.ResizeMode.Stretch)
+        self.job_table.setEditTriggers(QAbstractItemView.EditTrigger.NoEditTriggers)
+        self.job_table.cellDoubleClicked.connect(self.show_job_detail)
+        layout.addWidget(self.job_table, 1)
+
+        self.jobs = []
+        self.nlp_components = None
+        self.executor = None
+        self.executor_settings = None
+
+    def select_files(self):
+        files, _ = QFileDialog.getOpenFileNames(self, 'チャットのファイルを選択', filter='Parquet/csv(*.parquet *.csv)')
+        for file in files:
+            self.sources_input.appendPlainText(file)
+
+    def select_out_dir(self):
+        out_dir = QFileDialog.getExistingDirectory(self, '保存先のディレクトリを選択')
+        if out_dir:
+            self.out_dir_input.setText(out_dir)
+
+    def on_model_loaded(self, nlp_components):
+        self.nlp_components = nlp_components
+        self.add_button.setEnabled(True)
+
+    def add_jobs(self):
+        from pipeline import output_path
+
+        sources = [line.strip() for line in self.sources_input.toPlainText().splitlines() if line.strip()]
+        if not sources:
+            QMessageBox.warning(self, 'エラー', 'URLかファイルを入力してください。')
+            return
+        if not self.out_dir_input.text():
+            self.select_out_dir()
+            if not self.out_dir_input.text():
+                QMessageBox.warning(self, 'エラー', '保存先のディレクトリを入力してください。')
+                return
+        os.makedirs(self.out_dir_input.text(), exist_ok=True)
+        extension = f'.{self.file_format.currentText()}'
+        for source in sources:
+            job = {
+                'source': source,
+                'save_path': output_path(source, self.out_dir_input.text(), extension),
+                'skip_analyze': self.checkbox_skip_analyze.isChecked(),
+                'status': 'PENDING',
+                'worker': None,
+                'detail': '',
+            }
+            self.add_job_row(job)
+            self.jobs.append(job)
+        self.sources_input.clear()
+        self.start_pending_jobs()
+
+    def add_job_row(self, job):
+        row = self.job_table.rowCount()
+        self.job_table.insertRow(row)
+        source_item = QTableWidgetItem(job['source'])
+        source_item.setToolTip(job['save_path'])
+        self.job_table.setItem(row, SOURCE_COLUMN, source_item)
+        job['status_item'] = QTableWidgetItem(JOB_STATUS['PENDING'])
+        self.job_table.setItem(row, STATUS_COLUMN, job['status_item'])
+        job['progress_bar'] = QProgressBar()
+        self.job_table.setCellWidget(row, PROGRESS_COLUMN, job['progress_bar'])
+        job['cancel_button'] = QPushButton('キャンセル')
+        job['cancel_button'].clicked.connect(lambda: self.cancel_job(job))
+        self.job_table.setCellWidget(row, CANCEL_COLUMN, job['cancel_button'])
+
+    def running_jobs(self):
+        return [job for job in self.jobs if job['status'] in ('RUNNING', 'CANCELLING')]
+
+    def start_pending_jobs(self):
+        limit = int(self.max_jobs.currentText())
+        for job in self.jobs:
+            if len(self.running_jobs()) >= limit:
+                break
+            if job['status'] == 'PENDING':
+                self.start_job(job)
+        self.settings.setEnabled(not any(job['status'] in ('PENDING', 'RUNNING', 'CANCELLING') for job in self.jobs))
+
+    def shared_executor(self):
+        from pipeline import select_device
+        from shared_inference import SharedInferenceExecutor
+
+        # 設定が変わった場合のみ推論スレッドを作り直す。設定は実行中のジョブが無い時にしか変更できない
+        settings = (self.backend.currentText(), self.checkbox_force_cpu.isChecked(),
+                    int(self.batch_size.currentText()), int(self.token_size.currentText()))
+        if self.executor is None or self.executor_settings != settings:
+            if self.executor is not None:
+                # キャンセルしたジョブのバッチを推論中の場合があるため、終わるのを画面のスレッドで待たない
+                self.executor.close(wait=False)
+            backend, force_cpu, batch_size, token_size = settings
+            self.executor = SharedInferenceExecutor(self.nlp_components, backend, select_device(force_cpu),
+                                                    batch_size, token_size)
+            self.executor_settings = settings
+        return self.executor
+
+    def start_job(self, job):
+        is_file = os.path.isfile(job['source'])
+        executor = None if job['skip_analyze'] else self.shared_executor()
+        worker = Worker(
+            job['save_path'], '' if is_file else job['source'], job['skip_analyze'],
+            self.checkbox_force_cpu.isChecked(), int(self.batch_size.currentText()),
+            int(self.token_size.currentText()), self.nlp_components, None,
+            use_cache=self.checkbox_use_cache.isChecked(), backend=self.backend.currentText(),
+            input_path=job['source'] if is_file else None, executor=executor
+        )
+        worker.step_name.connect(lambda step_name: self.update_job_step(job, step_name))
+        worker.progress.connect(job['progress_bar'].setValue)
+        worker.error.connect(lambda error_msg: self.job_failed(job, error_msg))
+        worker.finished.connect(lambda: self.job_finished(job))
+        job['worker'] = worker
+        self.set_status(job, 'RUNNING')
+        worker.start()
+
+    def set_status(self, job, status, text=None):
+        job['status'] = status
+        job['status_item'].setText(text or JOB_STATUS[status])
+        if status == 'FAILED':
+            job['status_item'].setForeground(Qt.GlobalColor.red)
+        if status in ('COMPLETED', 'FAILED', 'CANCELLED'):
+            job['cancel_button'].setEnabled(False)
+
+    def update_job_step(self, job, step_name):
+        if job['status'] == 'RUNNING':
+            job['status_item'].setText(step_name)
+
+    def job_failed(self, job, error_msg):
+        if error_msg == ERROR_MESSAGE['CANCEL']:
+            self.set_status(job, 'CANCELLED')
+            return
+        job['detail'] = error_msg
+        # 詳細は行をダブルクリックすると表示する
+        self.set_status(job, 'FAILED', f"{JOB_STATUS['FAILED']}: {error_msg.splitlines()[0]}")
+        job['status_item'].setToolTip(error_msg)
+
+    def job_finished(self, job):
+        if job['status'] == 'CANCELLING':
+            self.set_status(job, 'CANCELLED')
+        elif job['status'] == 'RUNNING':
+            self.set_status(job, 'COMPLETED', job['status_item'].text())
+        self.start_pending_jobs()
+
+    def cancel_job(self, job):
+        if job['status'] == 'PENDING':
+            self.set_status(job, 'CANCELLED')
+            self.start_pending_jobs()
+        elif job['status'] == 'RUNNING':
+            job['worker'].requestInterruption()
+            self.set_status(job, 'CANCELLING')
+
+    def cancel_all(self):
+        # 待機中のジョブを先に取り消し、実行中のジョブが終わっても次のジョブが始まらないようにする
+        for job in self.jobs:
+            if job['status'] == 'PENDING':
+                self.set_status(job, 'CANCELLED')
+        for job in self.running_jobs():
+            self.cancel_job(job)
+        self.start_pending_jobs()
+
+    def clear_finished(self):
+        for row in reversed(range(len(self.jobs))):
+            if self.jobs[row]['status'] in ('COMPLETED', 'FAILED', 'CANCELLED'):
+                self.job_table.removeRow(row)
+                del self.jobs[row]
+
+    def show_job_detail(self, row, column):
+        job = self.jobs[row]
+        if job['detail']:
+            QMessageBox.warning(self, job['source'], job['detail'])
@@ -0,0 +1,42 @@
+import math
+
+import torch
+
+from constants import TOKENIZE_CHUNK_SIZE
+
+
+def length_sorted_batches(lengths, batch_size):
+    # トークン長の短い順に並べてからバッチに分割し、バッチ内のパディングを最小にする
+    order = sorted(range(len(lengths)), key=lengths.__getitem__)
+    return [order[i:i + batch_size] for i in range(0, len(order), batch_size)]
+
+
+def count_batches(n_texts, batch_size, dynamic_padding, chunk_size=TOKENIZE_CHUNK_SIZE):
+    if not dynamic_padding:
+        return math.ceil(n_texts / batch_size)
+    full_chunks, rest = divmod(n_texts, chunk_size)
+    return full_chunks * math.ceil(chunk_size / batch_size) + math.ceil(rest / batch_size)
+
+
+def pad_batch(sequences, pad_token_id):
+    max_length = max(map(len, sequences))
+    input_ids = torch.tensor([ids + [pad_token_id] * (max_length - len(ids)) for ids in sequences])
+    attention_mask = torch.tensor([[1] * len(ids) + [0] * (max_length - len(ids)) for ids in sequences])
+    return {'input_ids': input_ids, 'attention_mask': attention_mask}
+
+
+def iter_batches(texts, tokenizer, batch_size, token_size, dynamic_padding, chunk_size=TOKENIZE_CHUNK_SIZE):
+    # 全件を一度にトークナイズせず、一定件数毎にトークナイズしてそのままバッチのテンソルにする
+    if not dynamic_padding:
+        for start in range(0, len(texts), batch_size):
+            encoded = tokenizer(texts[start:start + batch_size], truncation=True, padding='max_length',
+                                max_length=token_size, return_tensors='pt', return_token_type_ids=False)
+            yield range(start, start + len(encoded['input_ids'])), dict(encoded)
+        return
+
+    for chunk_start in range(0, len(texts), chunk_size):
+        # 長さ順の並べ替えはチャンク内で行い、パディングはバッチ内の最長の系列に合わせる
+        input_ids = tokenizer(texts[chunk_start:chunk_start + chunk_size], truncation=True, max_length=token_size,
+                              return_token_type_ids=False, return_attention_mask=False)['input_ids']
+        for batch in length_sorted_batches([len(ids) for ids in input_ids], batch_size):
+            yield [chunk_start + i for i in batch], pad_batch([input_ids[i] for i in batch], tokenizer.pad_token_id)
@@ -0,0 +1,381 @@
+import json
+import os
+import queue
+import random
+import shutil
+import socket
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import requests
+
+from constants import PIPELINE_QUEUE_SIZE, TWITCH
+
+VIDEO_LENGTH_QUERY = 'query VideoLength($id: ID!) { video(id: $id) { lengthSeconds } }'
+
+
+def get_json_data(video_id, cursor=None, offset=0):
+    if cursor is None:
+        variables = {"videoID": video_id, "contentOffsetSeconds": offset}
+    else:
+        variables = {"videoID": video_id, "cursor": cursor}
+    loop_data = json.dumps([
+        {
+            "operationName": "VideoCommentsByOffsetOrCursor",
+            "variables": variables,
+            "extensions": {
+                "persistedQuery": {
+                    "version": 1,
+                    "sha256Hash": TWITCH['COMMENTS_QUERY_HASH']
+                }
+            }
+        }
+    ])
+    return loop_data
+
+
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+
+class RetryableHTTPError(requests.HTTPError):
+    pass
+
+
+# 応答の形が想定と異なる場合(GraphQLのエラーや削除・非公開の動画)は再試行しても変わらないため含めない
+RETRY_ERRORS = (RetryableHTTPError, requests.ConnectionError, requests.Timeout,
+                requests.exceptions.ChunkedEncodingError)
+
+
+def create_session(pool_size=1):
+    # 全ての区間で1つのセッションを共有し、接続を使い回す(keep-alive)
+    session = requests.Session()
+    session.headers = {'Client-ID': TWITCH['CLIENT_ID'], 'content-type': 'application/json'}
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+class AdaptivePacer:
+    # ページ間の待ち時間を、応答時間と429(レート制限)に応じて調整する。全ての区間のスレッドで共有する
+    def __init__(self):
+        self.interval = TWITCH['PAGE_INTERVAL']
+        self.latency = None
+        self.lock = threading.Lock()
+
+    def wait(self, check_cancelled):
+        with self.lock:
+            interval = self.interval
+        sleep(interval, check_cancelled)
+
+    def on_success(self, latency):
+        with self.lock:
+            if self.latency is not None and latency > max(self.latency * 2, TWITCH['SLOW_LATENCY']):
+                # 応答が急に遅くなった場合はサーバの負荷が高いとみなして間隔を空ける
+                self.interval = min(TWITCH['MAX_PAGE_INTERVAL'], self.interval * 1.5)
+            else:
+                self.interval = max(TWITCH['MIN_PAGE_INTERVAL'], self.interval * 0.9)
+            self.latency = latency if self.latency is None else self.latency * 0.8 + latency * 0.2
+
+    def on_throttled(self, retry_after=None):
+        with self.lock:
+            self.interval = min(TWITCH['MAX_PAGE_INTERVAL'], max(self.interval * 2, retry_after or 0))
+
+
+def sleep(seconds, check_cancelled):
+    # 長く待つ場合もキャンセルにすぐ反応できるよう、短く区切って待つ
+    deadline = time.monotonic() + seconds
+    while True:
+        check_cancelled()
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return
+        time.sleep(min(remaining, 0.5))
+
+
+def backoff_delay(attempt, retry_after=None):
+    delay = random.uniform(0, min(TWITCH['BACKOFF_MAX'], TWITCH['BACKOFF_BASE'] * 2 ** attempt))
+    return max(delay, retry_after or 0)
+
+
+def parse_retry_after(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def post_json(session, api_url, data, pacer, check_cancelled, extract, on_response=None):
+    # 一時的なエラー(5xx、429、通信エラー、途中で切れた応答)は再試行し、それ以外のエラーはそのまま送出する
+    for attempt in range(TWITCH['MAX_RETRIES'] + 1):
+        check_cancelled()
+        retry_after = None
+        try:
+            start = time.perf_counter()
+            response = session.post(api_url, data, timeout=TWITCH['TIMEOUT'])
+            latency = time.perf_counter() - start
+            if on_response is not None:
+                on_response(response)
+            if response.status_code in RETRY_STATUS:
+                if response.status_code == 429:
+                    retry_after = parse_retry_after(response.headers.get('Retry-After'))
+                    pacer.on_throttled(retry_after)
+                raise RetryableHTTPError(f'{response.status_code} Error for url: {api_url}', response=response)
+            response.raise_for_status()
+            result = extract(response.json())
+            pacer.on_success(latency)
+            return result
+        except RETRY_ERRORS:
+            if attempt == TWITCH['MAX_RETRIES']:
+                raise
+        sleep(backoff_delay(attempt, retry_after), check_cancelled)
+
+
+def fetch_video_length(session, api_url, video_id, check_cancelled):
+    # 長さが取得できない場合は分割せずに先頭から順に取得する。取得できない応答は再試行せずにすぐに諦める
+    try:
+        return int(post_json(
+            session, api_url, json.dumps([{'query': VIDEO_LENGTH_QUERY, 'variables': {'id': video_id}}]),
+            AdaptivePacer(), check_cancelled, lambda payload: payload[0]['data']['video']['lengthSeconds']
+        ))
+    except (requests.RequestException, KeyError, IndexError, TypeError, ValueError):
+        return None
+
+
+def split_shards(length_seconds, max_shards, min_shard_seconds):
+    if not length_seconds:
+        return [(0, None)]
+    count = max(1, min(max_shards, length_seconds // min_shard_seconds))
+    starts = [length_seconds * i // count for i in range(count)]
+    # 最後の区間は動画の長さを超えるコメントも取りこぼさないように終端を設けない
+    return list(zip(starts, starts[1:] + [None]))
+
+
+class ShardSpool:
+    # 区間毎に取得したページをファイルに追記し、中断した場合は最後のカーソルから再開できるようにする
+    def __init__(self, directory, start):
+        self.path = os.path.join(directory, f'shard-{start}.jsonl')
+
+    def load(self):
+        pages, cursor, done = [], None, False
+        if not os.path.exists(self.path):
+            return pages, cursor, done
+        with open(self.path, 'r', encoding='utf-8') as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # 書き込み途中で中断された行以降は使わない
+                    break
+                if record.get('done'):
+                    done = True
+                    break
+                pages.append(record['edges'])
+                cursor = record['cursor'] or cursor
+        return pages, cursor, done
+
+    def append(self, edges, cursor, done):
+        with open(self.path, 'a', encoding='utf-8') as file:
+            file.write(json.dumps({'edges': edges, 'cursor': cursor}, ensure_ascii=False) + '\n')
+            if done:
+                file.write(json.dumps({'done': True}) + '\n')
+
+
+def load_spool_shards(spool_dir, video_id):
+    path = os.path.join(spool_dir, 'manifest.json')
+    try:
+        with open(path, 'r', encoding='utf-8') as file:
+            manifest = json.load(file)
+    except (OSError, ValueError):
+        return None
+    if manifest.get('video_id') != video_id:
+        return None
+    return [tuple(shard) for shard in manifest['shards']], manifest.get('length_seconds')
+
+
+def create_spool(spool_dir, video_id, shards, length_seconds):
+    # 別の動画の途中のページが残っている場合は削除してから作り直す
+    remove_spool(spool_dir)
+    os.makedirs(spool_dir)
+    with open(os.path.join(spool_dir, 'manifest.json'), 'w', encoding='utf-8') as file:
+        json.dump({'video_id': video_id, 'shards': shards, 'length_seconds': length_seconds}, file)
+
+
+def remove_spool(spool_dir):
+    shutil.rmtree(spool_dir, ignore_errors=True)
+
+
+def fetch_shard(session, api_url, video_id, start, end, pacer, check_cancelled, on_response=None, spool=None):
+    cursor = None
+    if spool is not None:
+        pages, cursor, done = spool.load()
+        yield from pages
+        if done:
+            return
+
+    while True:
+        if cursor is None:
+            data = get_json_data(video_id, offset=start)
+        else:
+            data = get_json_data(video_id, cursor)
+        comments = post_json(session, api_url, data, pacer, check_cancelled,
+                             lambda payload: payload[0]['data']['video']['comments'], on_response)
+        edges = comments['edges']
+        page = [
+            edge for edge in edges
+            if start <= int(edge['node']['contentOffsetSeconds']) and
+            (end is None or int(edge['node']['contentOffsetSeconds']) < end)
+        ]
+        done = (not comments['pageInfo']['hasNextPage'] or not edges or
+                (end is not None and int(edges[-1]['node']['contentOffsetSeconds']) >= end))
+        if edges:
+            cursor = edges[-1]['cursor']
+        if spool is not None:
+            spool.append(page, cursor, done)
+        yield page
+
+        if done:
+            break
+        pacer.wait(check_cancelled)
+
+
+def iter_shard_pages(api_url, video_id, shards, check_cancelled, max_workers, on_response=None, spool_dir=None):
+    # 各区間を別々のスレッドで取得し、届いた順に(区間の開始, ページ)を返す。区間を取得し終えた時はページをNoneとする
+    # 分析が追いつかない場合は取得を待たせ、未分析のページがメモリに溜まり続けないようにする
+    pages = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    stopped = threading.Event()
+    workers = min(max_workers, len(shards))
+    session = create_session(workers)
+    pacer = AdaptivePacer()
+
+    def put(item):
+        # 読み出し側が終了した後は入れずに戻る
+        while not stopped.is_set():
+            try:
+                pages.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                pass
+
+    def worker(start, end):
+        spool = ShardSpool(spool_dir, start) if spool_dir is not None else None
+        for edges in fetch_shard(session, api_url, video_id, start, end, pacer, check_cancelled, on_response,
+                                 spool):
+            if stopped.is_set():
+                return
+            put((start, edges))
+        put((start, None))
+
+    executor = ThreadPoolExecutor(max_workers=workers)
+    try:
+        futures = [executor.submit(worker, start, end) for start, end in shards]
+        for future in futures:
+            future.add_done_callback(put)
+        remaining = len(futures)
+        while remaining:
+            item = pages.get()
+            if isinstance(item, Future):
+                # 区間の取得が終わった(または失敗した)
+                item.result()
+                remaining -= 1
+            else:
+                yield item
+    finally:
+        stopped.set()
+        executor.shutdown(wait=False, cancel_futures=True)
+        session.close()
+
+
+def fetch_comment_pages(api_url, video_id, check_cancelled, max_workers=TWITCH['MAX_WORKERS'],
+                        max_shards=TWITCH['MAX_SHARDS'], min_shard_seconds=TWITCH['MIN_SHARD_SECONDS'],
+                        on_response=None, spool_dir=None, on_progress=None):
+    # 前回中断したページが残っている場合は、同じ区間の分け方で続きから取得する
+    spooled = load_spool_shards(spool_dir, video_id) if spool_dir is not None else None
+    if spooled is None:
+        with create_session() as session:
+            length_seconds = fetch_video_length(session, api_url, video_id, check_cancelled)
+        shards = split_shards(length_seconds, max_shards, min_shard_seconds)
+        if spool_dir is not None:
+            create_spool(spool_dir, video_id, shards, length_seconds)
+    else:
+        shards, length_seconds = spooled
+
+    # 動画の長さが分かる場合は、各区間をどこまで取得したかから全体の取得済みの割合をon_progressに渡す
+    positions = {start: start for start, _ in shards}
+    ends = {start: end if end is not None else length_seconds for start, end in shards}
+
+    # 区間の境界で重複して取得されたコメントはidで取り除く
+    seen = set()
+    for start, edges in iter_shard_pages(api_url, video_id, shards, check_cancelled, max_workers, on_response,
+                                         spool_dir):
+        if edges is None:
+            positions[start] = ends[start] or positions[start]
+        elif edges:
+            positions[start] = max(positions[start], int(edges[-1]['node']['contentOffsetSeconds']))
+        if on_progress is not None and length_seconds:
+            on_progress(sum(min(positions[shard], ends[shard]) - shard for shard in positions) / length_seconds)
+        if edges is None:
+            continue
+        chats = []
+        seconds = []
+        for edge in edges:
+            key = edge['node'].get('id') or edge['cursor']
+            if key in seen:
+                continue
+            seen.add(key)
+            chats.append(edge['node']['message']['fragments'][0]['text'])
+            seconds.append(int(edge['node']['contentOffsetSeconds']))
+        yield chats, seconds
+
+
+def parse_irc_messages(lines):
+    # PRIVMSGの本文のみを取り出す。例: ":name!name@name.tmi.twitch.tv PRIVMSG #channel :こんにちは"
+    chats = []
+    for line in lines:
+        prefix, _, rest = line.partition(' PRIVMSG ')
+        if not rest or not prefix.startswith(':'):
+            continue
+        _, _, text = rest.partition(' :')
+        if text:
+            chats.append(text)
+    return chats
+
+
+def iter_live_messages(channel, check_cancelled, host=TWITCH['IRC_HOST'], port=TWITCH['IRC_PORT'],
+                       poll_interval=0.5):
+    # 配信中のチャットをIRCで受信し、受信した分毎に(チャット, 接続してからの秒数)を返す。
+    # 切断された場合は待ち時間を伸ばしながら接続し直す
+    started = time.monotonic()
+    attempt = 0
+    while True:
+        check_cancelled()
+        try:
+            with socket.create_connection((host, port), timeout=TWITCH['TIMEOUT']) as sock:
+                sock.settimeout(poll_interval)
+                sock.sendall(f"NICK {TWITCH['IRC_NICK']}\r\nJOIN #{channel.lower()}\r\n".encode('utf-8'))
+                rest = b''
+                while True:
+                    check_cancelled()
+                    try:
+                        data = sock.recv(1 << 16)
+                    except socket.timeout:
+                        continue
+                    if not data:
+                        raise ConnectionError('Twitchのチャットサーバから切断されました')
+                    attempt = 0
+                    lines = (rest + data).split(b'\r\n')
+                    rest = lines.pop()
+                    lines = [line.decode('utf-8', errors='replace') for line in lines]
+                    for line in lines:
+                        if line.startswith('PING'):
+                            sock.sendall(f"PONG{line[4:]}\r\n".encode('utf-8'))
+                    chats = parse_irc_messages(lines)
+                    if chats:
+                        second = int(time.monotonic() - started)
+                        yield chats, [second] * len(chats)
+        except OSError:
+            if attempt >= TWITCH['MAX_RETRIES']:
+                raise
+            sleep(backoff_delay(attempt), check_cancelled)
+            attempt += 1